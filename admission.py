@@ -0,0 +1,267 @@
+"""
+Admission control. Every request is given an estimated cost from its path
+and parameters, in units of roughly one natal chart, and is admitted only
+if
+
+- its client has that many units left in its token bucket, which refills
+  at ADMISSION_RATE units a second up to ADMISSION_BURST, and
+- the units of all requests in progress stay within ADMISSION_BUDGET.
+  Each request counts for at most ADMISSION_REQUEST_UNITS of it, so one
+  long request (a big batch or a long stream) can't lock everyone else
+  out, though its client's bucket is still charged its full cost.
+
+Otherwise it is turned away at once with a 429 (over quota) or a 503
+(server saturated) and a Retry-After, rather than queued until it times
+out.
+
+A client is its X-Token, if the token is listed in ADMISSION_TOKENS or,
+without that list, if it is one of the first ADMISSION_TOKENS_PER_ADDRESS
+tokens seen from the client address. Anything else is its address, so
+making up new tokens doesn't make up new quota. Behind proxies (Cloud Run's
+front end, a load balancer), set ADMISSION_TRUSTED_PROXIES to how many of
+them append to X-Forwarded-For, or every client has the proxy's address.
+
+"""
+
+import math
+import os
+import threading
+import time
+import weakref
+from datetime import date
+from caching import LRUCache
+
+rate = float(os.getenv("ADMISSION_RATE", 20))
+burst = float(os.getenv("ADMISSION_BURST", 200))
+budget = float(os.getenv("ADMISSION_BUDGET", 64))
+request_units = float(os.getenv("ADMISSION_REQUEST_UNITS", 16))
+# Known API keys, None to give any key a bucket
+tokens = (
+    {token.strip() for token in os.environ["ADMISSION_TOKENS"].split(",")}
+    if os.getenv("ADMISSION_TOKENS")
+    else None
+)
+tokens_per_address = int(os.getenv("ADMISSION_TOKENS_PER_ADDRESS", 4))
+trusted_proxies = int(os.getenv("ADMISSION_TRUSTED_PROXIES", 0))
+
+# Requests that are never throttled
+exempt = {"/", "/docs", "/redoc", "/openapi.json", "/metrics", "/cache/stats"}
+
+
+def client_address(forwarded_for, peer, trusted_proxies=trusted_proxies):
+    """The address of the client behind trusted_proxies proxies, each of
+    which appends the address it was connected from to X-Forwarded-For.
+    Entries left of those are whatever the client sent, so they're
+    ignored."""
+    if trusted_proxies and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return peer
+
+
+def number(params, name, default):
+    try:
+        return float(params.get(name, default))
+    except ValueError:
+        return default
+
+
+def days_between(params, start, end):
+    try:
+        first = date.fromisoformat(params[start][:10])
+        last = date.fromisoformat(params[end][:10])
+        return max((last - first).days, 0) + 1
+    except (KeyError, ValueError):
+        return 1
+
+
+def body_size(headers):
+    try:
+        return int(headers.get("content-length", 0))
+    except ValueError:
+        return 0
+
+
+def sampled_days(params, start, end, per_unit):
+    step = number(params, "step", 1)
+    return days_between(params, start, end) / (step if step > 0 else 1) / per_unit
+
+
+def solar_returns_cost(params, headers):
+    if params.get("light") in ("true", "1"):
+        return 1
+    first = number(params, "solar_return_year", 0)
+    return number(params, "end_year", first) - first + 1
+
+
+# Cost estimates from (query params, headers), for the routes whose cost
+# depends on them. Everything else costs one unit.
+route_costs = {
+    "/retrograde_calendar": lambda q, h: number(q, "n", 12) / 12,
+    "/get_weekly_forecast_data": lambda q, h: 7,
+    "/get_yearly_forecast_data": lambda q, h: 10 * number(q, "years", 1),
+    "/moon_calendar": lambda q, h: 10 * number(q, "days", 30) / 365,
+    "/aspect_timeline": lambda q, h: 20 * number(q, "days", 7) / 365,
+    "/ephemeris_table": lambda q, h: sampled_days(q, "start_date", "end_date", 1000),
+    "/planetary_positions/range": lambda q, h: sampled_days(q, "start", "end", 100),
+    "/solar_returns": solar_returns_cost,
+    # About a hundred bytes per subject
+    "/natal/batch": lambda q, h: body_size(h) / 100,
+    "/synastry/matrix": lambda q, h: body_size(h) / 1000,
+}
+
+
+# Actual costs of the body-weighted routes, charged once the body is parsed
+def batch_cost(subjects):
+    return subjects
+
+
+def matrix_cost(pairs):
+    # A 500 x 500 matrix takes about as long as 50 natal charts
+    return pairs / 5000
+
+
+def cost(path, params, headers):
+    estimate = route_costs.get(path)
+    if estimate is None:
+        return 1.0
+    return max(1.0, float(estimate(params, headers)))
+
+
+class Rejected(Exception):
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Admission:
+    def __init__(
+        self,
+        rate=rate,
+        burst=burst,
+        budget=budget,
+        request_units=request_units,
+        tokens=tokens,
+        tokens_per_address=tokens_per_address,
+        clock=time.monotonic,
+        max_clients=100_000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.budget = budget
+        self.request_units = request_units
+        self.tokens = tokens
+        self.tokens_per_address = tokens_per_address
+        self.clock = clock
+        self.in_flight = 0.0
+        self.requests = 0
+        self.counters = {"admitted": 0, "over_quota": 0, "saturated": 0}
+        # client -> (tokens, last refill), least recently seen dropped first
+        self._buckets = LRUCache(maxsize=max_clients)
+        # address -> tokens seen from it, without a list of known tokens
+        self._seen = LRUCache(maxsize=max_clients)
+        self._lock = threading.Lock()
+
+    def client(self, token, address):
+        """The bucket a request from address with the X-Token token (or
+        None) is charged to."""
+        if token:
+            if self.tokens is not None:
+                if token in self.tokens:
+                    return f"token:{token}"
+            else:
+                with self._lock:
+                    seen = self._seen.get(address) or ()
+                    if token in seen:
+                        return f"token:{token}"
+                    if len(seen) < self.tokens_per_address:
+                        self._seen.set(address, seen + (token,))
+                        return f"token:{token}"
+        return f"address:{address}"
+
+    def admit(self, client, cost):
+        """Reserves cost units for client, or raises Rejected. Admitted
+        requests must be released()."""
+        return self._take(client, cost)
+
+    def charge(self, client, held, cost):
+        """For an admitted request of client holding held units, whose cost
+        turns out to be cost once its body is read: reserves the difference
+        or raises Rejected. Returns the units the request now holds."""
+        cost = min(cost, self.burst)
+        if cost <= held:
+            return held
+        units = self.units(cost) - self.units(held)
+        return held + self._take(client, cost - held, units, new=False)
+
+    def units(self, cost):
+        """The part of the budget a request of cost holds."""
+        return min(cost, self.request_units)
+
+    def _take(self, client, cost, units=None, new=True):
+        now = self.clock()
+        # A request bigger than the whole bucket needs a full bucket
+        cost = min(cost, self.burst)
+        if units is None:
+            units = self.units(cost)
+        with self._lock:
+            tokens, updated = self._buckets.get(client) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                self._buckets.set(client, (tokens, now))
+                self.counters["over_quota"] += 1
+                raise Rejected(
+                    429,
+                    math.ceil((cost - tokens) / self.rate),
+                    "Request quota exceeded, try again later",
+                )
+            # An idle server takes any single request
+            others = self.requests if new else self.requests - 1
+            if others and self.in_flight + units > self.budget:
+                self._buckets.set(client, (tokens, now))
+                self.counters["saturated"] += 1
+                raise Rejected(503, 1, "Server is busy, try again later")
+            self._buckets.set(client, (tokens - cost, now))
+            self.in_flight += units
+            if new:
+                self.requests += 1
+                self.counters["admitted"] += 1
+        return cost
+
+    def release(self, cost):
+        with self._lock:
+            self.requests -= 1
+            self.in_flight = self.in_flight - self.units(cost) if self.requests else 0.0
+
+    def holding(self, body, cost):
+        """Wraps the async iterable body of an admitted response so that
+        cost is released once it has been sent, rather than when the
+        response starts: streamed bodies are computed as they are sent. An
+        iterator that is dropped without being finished releases it too."""
+        held = [cost]
+
+        def release():
+            try:
+                self.release(held.pop())
+            except IndexError:
+                pass
+
+        async def stream():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                release()
+
+        wrapped = stream()
+        weakref.finalize(wrapped, release)
+        return wrapped
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = self.in_flight
+        return stats
@@ -1,12 +1,41 @@
-from datetime import datetime, date, time
-from fastapi import FastAPI, Query, Header
-from fastapi.responses import RedirectResponse, PlainTextResponse
-from typing import Annotated
-from pydantic import BaseModel
+import asyncio
+import csv
+import io
+import json
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, date, time, timedelta, timezone
+from fastapi import FastAPI, Query, Header, Request
+from fastapi.responses import (
+    JSONResponse,
+    RedirectResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from typing import Annotated, Literal
+from pydantic import BaseModel, Field
 import starlette.status as status
 from immanuel import charts
 from immanuel.const import chart, names
+import admission
+import compatibility
+import ephemeris_index
+import formats
+import moon
+import profiling
+import sky
+from caching import cached, flights as cache_flights, response_cache
+from serializer import chart_response, encode, parse_fields
+from singleflight import SingleFlight
+from transits import natal_chart, progressed_chart, transits_chart
+import validators
+import workers
 from utils import (
+    aspect_timeline_data,
+    day_store,
+    ephemeris_table_data,
+    position_rows,
     retrograde_periods,
     daily_forecast_data,
     weekly_forecast_data,
@@ -22,6 +51,30 @@ tags_metadata = [
         "name": "retrograde_calendar",
         "description": "Retrograde calendar for a given year",
     },
+    {
+        "name": "moon_calendar",
+        "description": "Exact moon phases, sign ingresses and void-of-course periods over a date range",
+    },
+    {
+        "name": "sky",
+        "description": "Snapshot of the current sky, refreshed in the background",
+    },
+    {
+        "name": "synastry_matrix",
+        "description": "Aspect counts and compatibility scores for many pairs of subjects at once",
+    },
+    {
+        "name": "natal_batch",
+        "description": "Natal charts for many subjects at once, streamed back as NDJSON",
+    },
+    {
+        "name": "aspect_timeline",
+        "description": "Orb entry, exact and orb exit times of the aspects between planets over a date range",
+    },
+    {
+        "name": "ephemeris_table",
+        "description": "Planet positions sampled over a date range",
+    },
     {
         "name": "get_daily_forecast_data",
         "description": "Get daily forecast data - planet positions, major aspects, moon phase etc - for a given date",
@@ -36,15 +89,143 @@ tags_metadata = [
     },
 ]
 
+
+prewarm_days = int(os.getenv("FORECAST_PREWARM_DAYS", 0))
+prewarm_interval = int(os.getenv("FORECAST_PREWARM_INTERVAL", 6 * 3600))
+
+
+async def prewarm_forecasts():
+    while True:
+        await asyncio.to_thread(day_store.prewarm, date.today(), prewarm_days)
+        await asyncio.sleep(prewarm_interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ephemeris_index.load()
+    workers.start()
+    prewarm = asyncio.create_task(prewarm_forecasts()) if prewarm_days else None
+    sky_refresh = asyncio.create_task(sky.refresh_forever())
+    yield
+    sky_refresh.cancel()
+    if prewarm is not None:
+        prewarm.cancel()
+    workers.shutdown()
+
+
+if profiling.enabled:
+    profiling.install()
+
 app = FastAPI(
     title="Skylar May API",
     description="API for building astrological charts. Based on swisseph and immanuel.",
     version="0.0.1",
     license_info={"name": "MIT License", "identifier": "MIT"},
     openapi_tags=tags_metadata,
+    lifespan=lifespan,
 )
 
 
+admission_control = admission.Admission()
+
+
+@app.middleware("http")
+async def admit(request: Request, call_next):
+    path = request.url.path
+    if path in admission.exempt:
+        return await call_next(request)
+    client = admission_control.client(
+        request.headers.get("x-token"),
+        admission.client_address(
+            request.headers.get("x-forwarded-for"),
+            request.client.host if request.client else "anonymous",
+        ),
+    )
+    cost = admission.cost(path, request.query_params, request.headers)
+    try:
+        cost = admission_control.admit(client, cost)
+    except admission.Rejected as e:
+        return rejected(request, e)
+    # Handlers may charge() more once they have read the body
+    ticket = request.state.admission = {"client": client, "cost": cost}
+    try:
+        response = await call_next(request)
+    except BaseException:
+        admission_control.release(ticket["cost"])
+        raise
+    response.body_iterator = admission_control.holding(
+        response.body_iterator, ticket["cost"]
+    )
+    return response
+
+
+def charge(request, cost):
+    """Charges an admitted request its actual cost once its body has been
+    parsed, raising admission.Rejected if the client can't afford it."""
+    ticket = request.state.admission
+    ticket["cost"] = admission_control.charge(ticket["client"], ticket["cost"], cost)
+
+
+@app.middleware("http")
+async def conditional(request: Request, call_next):
+    path = request.url.path
+    if request.method != "GET" or not validators.cacheable(path):
+        return await call_next(request)
+    headers = {
+        "ETag": validators.etag(
+            path, request.query_params.multi_items(), request.headers.get("accept")
+        ),
+        "Cache-Control": validators.cache_control(path),
+    }
+    if validators.matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response = await call_next(request)
+    if response.status_code == status.HTTP_200_OK:
+        response.headers.update(headers)
+    return response
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    profile = profiling.allow_profile and request.query_params.get("profile") == "1"
+    with profiling.request(profile) as current:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    profiling.metrics.observe(
+        route.path if route else "unmatched", response.status_code, current
+    )
+    if profile:
+        return PlainTextResponse("\n".join(current.reports))
+    response.headers["Server-Timing"] = current.server_timing()
+    return response
+
+
+@app.exception_handler(admission.Rejected)
+def rejected(request: Request, exc: admission.Rejected):
+    return JSONResponse(
+        {"success": 0, "error": exc.reason},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(workers.Busy)
+def workers_busy(request: Request, exc: workers.Busy):
+    return JSONResponse(
+        {"success": 0, "error": "Too many requests in progress, try again later"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(asyncio.TimeoutError)
+def workers_timeout(request: Request, exc: asyncio.TimeoutError):
+    return JSONResponse(
+        {"success": 0, "error": "Calculation timed out"},
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+    )
+
+
 class PlanetDescription(BaseModel):
     name: str
     latitude: str
@@ -77,13 +258,93 @@ class RetrogradeCalendarResponse(BaseModel):
     data: list[PeriodsForPlanet]
 
 
+planet_indexes = {name.lower(): index for index, name in names.PLANETS.items()}
+
+# Coalesces identical uncached calculations that are in flight at once
+flights = SingleFlight()
+
+yearly_max_years = int(os.getenv("YEARLY_MAX_YEARS", 10))
+moon_calendar_max_days = int(os.getenv("MOON_CALENDAR_MAX_DAYS", 3660))
+solar_returns_max_years = int(os.getenv("SOLAR_RETURNS_MAX_YEARS", 100))
+aspect_timeline_max_days = int(os.getenv("ASPECT_TIMELINE_MAX_DAYS", 3660))
+matrix_max_pairs = int(os.getenv("MATRIX_MAX_PAIRS", 250_000))
+ephemeris_table_max_rows = int(os.getenv("EPHEMERIS_TABLE_MAX_ROWS", 36600))
+positions_range_max_samples = int(os.getenv("POSITIONS_RANGE_MAX_SAMPLES", 36600))
+batch_max_subjects = int(os.getenv("BATCH_MAX_SUBJECTS", 5000))
+batch_chunk_size = int(os.getenv("BATCH_CHUNK_SIZE", 16))
+
+
+class BatchSubject(BaseModel):
+    id: str | int
+    year: int
+    month: int
+    day: int
+    hour: int = 0
+    lat: float
+    lon: float
+
+
+class NatalBatchRequest(BaseModel):
+    subjects: list[BatchSubject] = Field(max_length=batch_max_subjects)
+    fields: str | None = None
+
+
+class CompatibilityRequest(BaseModel):
+    subjects: list[BatchSubject] = Field(min_length=1)
+    others: list[BatchSubject] | None = Field(default=None, min_length=1)
+
+
+def utc(date_time):
+    if date_time.tzinfo is None:
+        return date_time
+    return date_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# Media types offered for documents and for tabular results
+documents = (formats.JSON, formats.MSGPACK)
+tables = (formats.JSON, formats.MSGPACK, formats.ARROW)
+
+
+def negotiated(content, accept, rows=None):
+    """content as JSON or MessagePack, or if rows is given rows(content["data"])
+    as Arrow, whichever accept prefers."""
+    media_type = formats.negotiate(accept, documents if rows is None else tables)
+    if media_type == formats.ARROW:
+        body = formats.arrow_bytes(rows(content["data"]))
+    else:
+        body = encode(content, media_type=media_type)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def retrograde_rows(calendar):
+    return [
+        {"planet": planet["planet"], **period}
+        for planet in calendar
+        for period in planet["periods"]
+    ]
+
+
 @app.get("/")
 def root():
     return RedirectResponse(url="/docs", status_code=status.HTTP_302_FOUND)
 
 
 @app.get("/planetary_positions", tags=["planetary_positions"])
-def planetary_positions(
+@cached(response_cache, offered=documents)
+async def planetary_positions(
     year: Annotated[
         int,
         Query(
@@ -125,13 +386,13 @@ def planetary_positions(
         ),
     ],
     hour: Annotated[
-        int,
+        int | None,
         Query(
             title="Hour",
-            description="Hour of birth, if you know it (e.g. 12)",
+            description="Hour of birth, if you know it (e.g. 12). Houses are only given with it",
             examples=[15],
         ),
-    ] = 0,
+    ] = None,
     min: Annotated[
         int,
         Query(
@@ -148,6 +409,21 @@ def planetary_positions(
             examples=[53],
         ),
     ] = 0,
+    objects: Annotated[
+        str | None,
+        Query(
+            title="Objects",
+            description="Comma separated planets to return, Sun to Pluto by default (e.g. Sun,Moon,Mars)",
+            examples=["Sun,Moon,Mars"],
+        ),
+    ] = None,
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/json (default) or application/msgpack",
+        ),
+    ] = None,
     x_token: Annotated[
         str | None,
         Header(
@@ -157,35 +433,120 @@ def planetary_positions(
         ),
     ] = None,
 ) -> PlanetPositionsResponse:
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    natal_chart = charts.Natal(native)
-    objects = []
-    for obj in natal_chart.objects.values():
-        if obj.type.index == chart.PLANET:
-            objects.append(
-                {
-                    "name": obj.name,
-                    "latitude": obj.latitude.formatted,
-                    "longitude": obj.longitude.formatted,
-                    "sign": obj.sign.name,
-                    "sign_longitude": obj.sign_longitude.formatted,
-                    "house": obj.house.name,
-                    "speed": obj.speed,
-                    "distance": obj.distance,
-                    "movement": obj.movement.formatted,
-                }
+    indexes = None
+    if objects is not None:
+        names = {name.lower() for name in parse_fields(objects) or ()}
+        if not names:
+            return JSONResponse(
+                {"success": 0, "error": "No objects given"},
+                status_code=status.HTTP_400_BAD_REQUEST,
             )
-    return {"success": 1, "data": objects}
+        try:
+            indexes = [planet_indexes[name] for name in names]
+        except KeyError as e:
+            return JSONResponse(
+                {"success": 0, "error": f"Unknown object {e}"},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+        # Each object once, in the usual order
+        indexes.sort(key=list(planet_indexes.values()).index)
+    positions = await workers.run(
+        workers.planet_positions,
+        datetime(year, month, day, hour or 0, 0, 0),
+        lat,
+        lon,
+        indexes,
+        hour is not None,
+    )
+    return {"success": 1, "data": positions}
+
+
+@app.get("/planetary_positions/range", tags=["planetary_positions"])
+def planetary_positions_range(
+    start: Annotated[
+        datetime,
+        Query(
+            title="Start",
+            description="First sample, UTC unless an offset is given (e.g. 2024-01-01T00:00)",
+        ),
+    ],
+    end: Annotated[
+        datetime,
+        Query(
+            title="End",
+            description="Last moment to sample (inclusive)",
+        ),
+    ],
+    step: Annotated[
+        float,
+        Query(
+            title="Step",
+            description="Days between samples (e.g. 0.25 for every 6 hours)",
+            gt=0,
+        ),
+    ] = 1.0,
+    format: Annotated[
+        Literal["ndjson", "csv", "arrow"] | None,
+        Query(
+            title="Format",
+            description="ndjson, csv or arrow. By default the one Accept prefers, ndjson if none",
+        ),
+    ] = None,
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/x-ndjson (default) or application/vnd.apache.arrow.stream",
+        ),
+    ] = None,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    start, end = utc(start), utc(end)
+    if end < start:
+        return JSONResponse(
+            {"success": 0, "error": "end is before start"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    if (end - start).total_seconds() / 86400 / step + 1 > positions_range_max_samples:
+        return JSONResponse(
+            {
+                "success": 0,
+                "error": f"At most {positions_range_max_samples} samples per request",
+            },
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    rows = position_rows(start, end, step)
+    if format is None:
+        media_type = formats.negotiate(accept, ("application/x-ndjson", formats.ARROW))
+        format = "arrow" if media_type == formats.ARROW else "ndjson"
+    if format == "csv":
+        return StreamingResponse(csv_lines(rows), media_type="text/csv")
+    if format == "arrow":
+        rows = (dict(row, date=datetime.fromisoformat(row["date"])) for row in rows)
+        return StreamingResponse(
+            formats.arrow_stream(formats.record_batches(rows)),
+            media_type=formats.ARROW,
+        )
+    return StreamingResponse(
+        (json.dumps(row) + "\n" for row in rows), media_type="application/x-ndjson"
+    )
 
 
 @app.get("/retrograde_calendar", tags=["retrograde_calendar"])
-def retrograde_calendar(
+async def retrograde_calendar(
     n: Annotated[
         int,
         Query(
             title="N of months",
             description="Number of next months to show calendar for",
             examples=[12],
+            ge=1,
         ),
     ],
     lat: Annotated[
@@ -204,6 +565,13 @@ def retrograde_calendar(
             examples=[43.8399],
         ),
     ],
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/json (default), application/msgpack or application/vnd.apache.arrow.stream",
+        ),
+    ] = None,
     x_token: Annotated[
         str | None,
         Header(
@@ -213,7 +581,16 @@ def retrograde_calendar(
         ),
     ] = None,
 ) -> RetrogradeCalendarResponse:
-    retro_table = retrograde_periods(n, lat, lon)
+    now = sky.current().moment.replace(tzinfo=None)
+    retro_table = await flights.run(
+        ("retrograde_calendar", n, lat, lon, now),
+        workers.run,
+        retrograde_periods,
+        n,
+        lat,
+        lon,
+        now,
+    )
     response = []
     for obj, days in retro_table.items():
         asteroid = round(obj, -2) == chart.ASTEROID
@@ -224,11 +601,46 @@ def retrograde_calendar(
                 "periods": [{"start": x[0].date(), "end": x[1].date()} for x in days],
             }
         )
-    return {"success": 1, "data": response}
+    return negotiated({"success": 1, "data": response}, accept, retrograde_rows)
+
+
+@app.get("/moon_calendar", tags=["moon_calendar"])
+@cached(response_cache)
+async def moon_calendar(
+    start_date: Annotated[
+        date,
+        Query(
+            title="Start date",
+            description="First day of the calendar, from 00:00 UT",
+            examples=[date.today()],
+        ),
+    ],
+    days: Annotated[
+        int,
+        Query(
+            title="Days",
+            description="Number of days to cover",
+            ge=1,
+            le=moon_calendar_max_days,
+        ),
+    ] = 30,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    start = datetime.combine(start_date, time.min)
+    end = start + timedelta(days=days)
+    calendar = await workers.run(moon.calendar_data, start, end)
+    return {"success": 1, "data": calendar}
 
 
 @app.get("/natal.json")
-def natal_text(
+@cached(response_cache, offered=documents)
+async def natal_json(
     year: Annotated[
         int,
         Query(
@@ -285,6 +697,20 @@ def natal_text(
             description="Second of birth, if you know it (e.g. 53)",
         ),
     ] = 0,
+    fields: Annotated[
+        str | None,
+        Query(
+            title="Fields",
+            description="Comma separated top-level chart fields to return (e.g. objects,aspects)",
+        ),
+    ] = None,
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/json (default) or application/msgpack",
+        ),
+    ] = None,
     x_token: Annotated[
         str | None,
         Header(
@@ -293,13 +719,21 @@ def natal_text(
         ),
     ] = None,
 ):
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    # return json.loads( json.dumps(charts.Natal(native), cls=ToJSON, indent=4) )
-    return charts.Natal(native)
+    media_type = formats.negotiate(accept, documents)
+    data = await workers.run(
+        workers.natal_json,
+        datetime(year, month, day, hour, 0, 0),
+        lat,
+        lon,
+        parse_fields(fields),
+        media_type,
+    )
+    return Response(content=data, media_type=media_type)
 
 
 @app.get("/natal.txt")
-def natal_text(
+@cached(response_cache, media_type="text/plain")
+async def natal_text(
     year: Annotated[
         int,
         Query(
@@ -364,33 +798,86 @@ def natal_text(
         ),
     ] = None,
 ):
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    # return json.loads( json.dumps(charts.Natal(native), cls=ToJSON, indent=4) )
-    natal = charts.Natal(native)
-    objects = ""
-    for object in natal.objects.values():
-        objects += f"{object}\n"
-    response = f"""
-Daytime: {natal.diurnal}
-Moon Phase: {natal.moon_phase}
-{objects}
-"""
+    response = await workers.run(
+        workers.natal_text, datetime(year, month, day, hour, 0, 0), lat, lon
+    )
     return PlainTextResponse(response)
 
 
+@app.post("/natal/batch", tags=["natal_batch"])
+async def natal_batch(
+    batch: NatalBatchRequest,
+    request: Request,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    subjects = [subject.model_dump() for subject in batch.subjects]
+    charge(request, admission.batch_cost(len(subjects)))
+    fields = parse_fields(batch.fields)
+    workers.check()
+    chunks = [
+        subjects[i : i + batch_chunk_size]
+        for i in range(0, len(subjects), batch_chunk_size)
+    ]
+
+    async def lines():
+        async for chunk, result in workers.run_each(
+            workers.natal_lines, chunks, fields
+        ):
+            if isinstance(result, Exception):
+                result = b"".join(
+                    workers.error_line(subject["id"], result) for subject in chunk
+                )
+            yield result
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/transits")
-def transits(year: int, month: int, day: int, hour: int, lat: float, lon: float):
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    return charts.Transits(native)
+def transits(
+    year: int,
+    month: int,
+    day: int,
+    hour: int,
+    lat: float,
+    lon: float,
+    fields: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
+):
+    natal = natal_chart(datetime(year, month, day, hour, 0, 0), lat, lon)
+    return chart_response(
+        transits_chart(natal, sky.current().moment),
+        fields,
+        formats.negotiate(accept, documents),
+    )
 
 
 @app.post("/progressions")
-def progressions(year: int, month: int, day: int, hour: int, lat: float, lon: float):
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    return charts.Progressed(native, datetime.now())
+def progressions(
+    year: int,
+    month: int,
+    day: int,
+    hour: int,
+    lat: float,
+    lon: float,
+    fields: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
+):
+    natal = natal_chart(datetime(year, month, day, hour, 0, 0), lat, lon)
+    return chart_response(
+        progressed_chart(natal, sky.current().moment),
+        fields,
+        formats.negotiate(accept, documents),
+    )
 
 
 @app.post("/synastry")
+@cached(response_cache, offered=documents)
 def synastry(
     year: int,
     month: int,
@@ -404,13 +891,53 @@ def synastry(
     hour2: int,
     lat2: float,
     lon2: float,
+    fields: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
 ):
     native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
     native2 = charts.Subject(datetime(year2, month2, day2, hour2, 0, 0), lat2, lon2)
-    return charts.Synastry(native, native2)
+    # immanuel has no dedicated synastry chart, a natal chart aspecting the
+    # partner's chart is the documented equivalent
+    synastry = charts.Natal(native, aspects_to=charts.Natal(native2))
+    return chart_response(synastry, fields, formats.negotiate(accept, documents))
+
+
+@app.post("/synastry/matrix", tags=["synastry_matrix"])
+async def synastry_matrix(
+    compatibility_request: CompatibilityRequest,
+    request: Request,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    subjects = [subject.model_dump() for subject in compatibility_request.subjects]
+    others = (
+        [subject.model_dump() for subject in compatibility_request.others]
+        if compatibility_request.others is not None
+        else None
+    )
+    pairs = len(subjects) * len(others if others is not None else subjects)
+    if pairs > matrix_max_pairs:
+        return JSONResponse(
+            {"success": 0, "error": f"At most {matrix_max_pairs} pairs per request"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    charge(request, admission.matrix_cost(pairs))
+    try:
+        matrix = await workers.run(compatibility.matrix_data, subjects, others)
+    except ValueError as e:
+        return JSONResponse(
+            {"success": 0, "error": str(e)}, status_code=status.HTTP_400_BAD_REQUEST
+        )
+    return {"success": 1, "data": matrix}
 
 
 @app.post("/composite")
+@cached(response_cache, offered=documents)
 def composite(
     year: int,
     month: int,
@@ -424,14 +951,19 @@ def composite(
     hour2: int,
     lat2: float,
     lon2: float,
+    fields: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
 ):
     native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
     native2 = charts.Subject(datetime(year2, month2, day2, hour2, 0, 0), lat2, lon2)
-    return charts.Composite(native, native2)
+    return chart_response(
+        charts.Composite(native, native2), fields, formats.negotiate(accept, documents)
+    )
 
 
 @app.post("/solar_returns")
-def solar_returns(
+@cached(response_cache, offered=documents)
+async def solar_returns(
     year: int,
     month: int,
     day: int,
@@ -439,9 +971,45 @@ def solar_returns(
     lat: float,
     lon: float,
     solar_return_year: int,
+    end_year: int | None = None,
+    light: bool = False,
+    fields: str | None = None,
+    accept: Annotated[str | None, Header()] = None,
 ):
-    native = charts.Subject(datetime(year, month, day, hour, 0, 0), lat, lon)
-    return charts.SolarReturn(native, solar_return_year)
+    date_time = datetime(year, month, day, hour, 0, 0)
+    media_type = formats.negotiate(accept, documents)
+    if end_year is None and not light:
+        data = await workers.run(
+            workers.solar_return_json,
+            date_time,
+            lat,
+            lon,
+            solar_return_year,
+            parse_fields(fields),
+            media_type,
+        )
+        return Response(content=data, media_type=media_type)
+    last_year = solar_return_year if end_year is None else end_year
+    if not 0 <= last_year - solar_return_year < solar_returns_max_years:
+        return JSONResponse(
+            {
+                "success": 0,
+                "error": f"end_year must be within {solar_returns_max_years - 1} years after solar_return_year",
+            },
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    data = await workers.run(
+        workers.solar_returns_json,
+        date_time,
+        lat,
+        lon,
+        solar_return_year,
+        last_year,
+        parse_fields(fields),
+        light,
+        media_type,
+    )
+    return Response(content=data, media_type=media_type)
 
 
 @app.get("/get_daily_forecast_data", tags=["get_daily_forecast_data"])
@@ -477,7 +1045,7 @@ def get_weekly_forecast_data(
 
 
 @app.get("/get_yearly_forecast_data", tags=["get_yearly_forecast_data"])
-def get_yearly_forecast_data(
+async def get_yearly_forecast_data(
     start_date: Annotated[
         date,
         Query(
@@ -486,7 +1054,168 @@ def get_yearly_forecast_data(
             examples=[date.today()],
         ),
     ],
+    years: Annotated[
+        int,
+        Query(
+            title="Years",
+            description="Number of 365-day years to cover",
+            ge=1,
+            le=yearly_max_years,
+        ),
+    ] = 1,
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/json (default), application/msgpack or application/vnd.apache.arrow.stream",
+        ),
+    ] = None,
 ):
     datetime_obj = datetime.combine(start_date, time.min)
-    yfd = yearly_forecast_data(datetime_obj)
-    return {"success": 1, "data": yfd}
+    yfd = await flights.run(
+        ("yearly_forecast", datetime_obj, years),
+        workers.run,
+        yearly_forecast_data,
+        datetime_obj,
+        years,
+    )
+    return negotiated({"success": 1, "data": yfd}, accept, formats.period_rows)
+
+
+@app.get("/aspect_timeline", tags=["aspect_timeline"])
+@cached(response_cache)
+async def aspect_timeline(
+    start_date: Annotated[
+        date,
+        Query(
+            title="Start date",
+            description="First day of the timeline, from 00:00 UT",
+            examples=[date.today()],
+        ),
+    ],
+    days: Annotated[
+        int,
+        Query(
+            title="Days",
+            description="Number of days to cover",
+            ge=1,
+            le=aspect_timeline_max_days,
+        ),
+    ] = 7,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    start = datetime.combine(start_date, time.min)
+    timeline = await workers.run(aspect_timeline_data, start, days)
+    return {"success": 1, "data": timeline}
+
+
+@app.get("/ephemeris_table", tags=["ephemeris_table"])
+async def ephemeris_table(
+    start_date: Annotated[
+        date,
+        Query(
+            title="Start date",
+            description="First sample, at 00:00 UT",
+            examples=[date.today()],
+        ),
+    ],
+    end_date: Annotated[
+        date,
+        Query(
+            title="End date",
+            description="Last day to sample (inclusive)",
+            examples=[date.today()],
+        ),
+    ],
+    step: Annotated[
+        float,
+        Query(
+            title="Step",
+            description="Days between samples (e.g. 0.5)",
+            gt=0,
+        ),
+    ] = 1.0,
+    accept: Annotated[
+        str | None,
+        Header(
+            title="Accept",
+            description="application/json (default), application/msgpack or application/vnd.apache.arrow.stream",
+        ),
+    ] = None,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    if end_date < start_date:
+        return JSONResponse(
+            {"success": 0, "error": "end_date is before start_date"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    if (end_date - start_date).days / step + 1 > ephemeris_table_max_rows:
+        return JSONResponse(
+            {
+                "success": 0,
+                "error": f"At most {ephemeris_table_max_rows} samples per request",
+            },
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date, time.min)
+    table = await workers.run(ephemeris_table_data, start, end, step)
+    return negotiated({"success": 1, "data": table}, accept, formats.column_rows)
+
+
+@app.get("/sky/now", tags=["sky"])
+def sky_now(
+    if_none_match: Annotated[str | None, Header()] = None,
+    x_token: Annotated[
+        str | None,
+        Header(
+            title="X-Token",
+            description="Your API key",
+        ),
+    ] = None,
+):
+    snapshot = sky.current()
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": f"public, max-age={sky.refresh_interval}",
+    }
+    if validators.matches(if_none_match, snapshot.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=snapshot.body, media_type="application/json", headers=headers
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    stats = admission_control.stats()
+    lines = ["# TYPE api_admission_total counter"]
+    for outcome in ("admitted", "over_quota", "saturated"):
+        lines.append(f'api_admission_total{{outcome="{outcome}"}} {stats[outcome]}')
+    lines.append("# TYPE api_admission_in_flight_units gauge")
+    lines.append(f"api_admission_in_flight_units {stats['in_flight']}")
+    return PlainTextResponse(
+        profiling.metrics.render() + "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = response_cache.stats()
+    stats["coalesced"] = sum(
+        f.stats()["followers"] for f in (cache_flights, flights, day_store.flights)
+    )
+    return {"success": 1, "data": stats}
@@ -0,0 +1,151 @@
+"""
+Exact aspect timing. For every pair of objects, the difference of their
+longitudes is sampled daily with PositionTable and cut at the pair's
+relative stations, so that it is monotonic between consecutive breakpoints.
+Every crossing of an aspect angle or of its orb boundaries is then bracketed
+by two breakpoints and refined with a safeguarded Newton iteration.
+
+Only the aspect angles the pair's relative longitude comes within orb of
+over the range are searched, so slow pairs cost next to nothing.
+
+"""
+
+import itertools
+import math
+import numpy as np
+import swisseph as swe
+from immanuel.const import calc
+from events import bisect_root, tolerance
+from positions import PositionTable, swe_bodies
+
+max_iterations = 50
+
+
+def allowed(settings, a, b, aspect):
+    """Whether either object may initiate the aspect with the other."""
+    rule_a = settings.aspect_rules.get(a, settings.default_aspect_rule)
+    rule_b = settings.aspect_rules.get(b, settings.default_aspect_rule)
+    return (aspect in rule_a["initiate"] and aspect in rule_b["receive"]) or (
+        aspect in rule_b["initiate"] and aspect in rule_a["receive"]
+    )
+
+
+def pair_orb(settings, a, b, aspect):
+    """Orb of the aspect between a and b, as in immanuel.reports.aspect."""
+    orb_a = settings.orbs[a][aspect] if a in settings.orbs else settings.default_orb
+    orb_b = settings.orbs[b][aspect] if b in settings.orbs else settings.default_orb
+    if settings.orb_calculation == calc.MEAN:
+        return (orb_a + orb_b) / 2
+    return max(orb_a, orb_b)
+
+
+def relative(a, b, jd):
+    """Longitude of b minus longitude of a, and its speed."""
+    position_a = swe.calc_ut(jd, swe_bodies[a])[0]
+    position_b = swe.calc_ut(jd, swe_bodies[b])[0]
+    return position_b[0] - position_a[0], position_b[3] - position_a[3]
+
+
+def refine(a, b, level, jd, next_jd, offset):
+    """When the relative longitude of a and b passes level (mod 360)
+    between jd and next_jd, where it is monotonic. offset is its
+    difference from level at jd. Newton steps that leave the bracket are
+    replaced by bisection."""
+    low, high = jd, next_jd
+    t = (low + high) / 2
+    for _ in range(max_iterations):
+        lon, speed = relative(a, b, t)
+        difference = swe.difdeg2n(lon, level)
+        if (difference < 0) == (offset < 0):
+            low, offset = t, difference
+        else:
+            high = t
+        following = t - difference / speed if speed else low
+        if not low < following < high:
+            following = (low + high) / 2
+        if abs(following - t) < tolerance:
+            return following
+        t = following
+    return t
+
+
+def breakpoints(a, b, jds, lon, speed):
+    """The samples plus the pair's relative stations, with the unwrapped
+    relative longitude at each."""
+    points, values = [jds[0]], [lon[0]]
+    for i in range(len(jds) - 1):
+        if (speed[i] < 0) != (speed[i + 1] < 0):
+            station = bisect_root(
+                lambda t: relative(a, b, t)[1], jds[i], jds[i + 1], speed[i]
+            )
+            value = relative(a, b, station)[0]
+            points.append(station)
+            values.append(lon[i] + swe.difdeg2n(value, lon[i]))
+        points.append(jds[i + 1])
+        values.append(lon[i + 1])
+    return np.array(points), np.array(values)
+
+
+def targets(aspect, low, high):
+    """Unwrapped relative longitudes between low and high at which the
+    pair is in the aspect."""
+    found = set()
+    for k in range(math.floor((low - 180) / 360), math.ceil((high + 180) / 360) + 1):
+        for angle in (aspect, -aspect):
+            value = angle + 360 * k
+            if low <= value <= high:
+                found.add(value)
+    return sorted(found)
+
+
+def find_aspects(start_jd, end_jd, objects, settings):
+    """Every time each pair of objects is within orb of one of the settings'
+    aspects between start_jd and end_jd, as (a, b, aspect, enters, leaves,
+    exact) tuples sorted by when they begin. enters and leaves are None when
+    the pair is already / still in orb at the ends of the range, exact is
+    the list of the aspect's perfections in the window."""
+    jds = np.append(np.arange(start_jd, end_jd, 1.0), end_jd)
+    table = PositionTable(jds, objects)
+    windows = []
+
+    for a, b in itertools.combinations(objects, 2):
+        lon = np.unwrap(
+            table.longitude[table.row(b)] - table.longitude[table.row(a)], period=360
+        )
+        speed = table.speed[table.row(b)] - table.speed[table.row(a)]
+        points, values = breakpoints(a, b, jds.tolist(), lon.tolist(), speed.tolist())
+        low, high = values.min(), values.max()
+
+        for aspect in settings.aspects:
+            if not allowed(settings, a, b, aspect):
+                continue
+            orb = pair_orb(settings, a, b, aspect)
+            for target in targets(aspect, low - orb, high + orb):
+                events = []
+                for level, kind in (
+                    (target - orb, "boundary"),
+                    (target, "exact"),
+                    (target + orb, "boundary"),
+                ):
+                    offsets = values - level
+                    for i in np.nonzero((offsets[:-1] < 0) != (offsets[1:] < 0))[
+                        0
+                    ].tolist():
+                        jd = refine(a, b, level, points[i], points[i + 1], offsets[i])
+                        events.append((jd, kind))
+
+                inside = abs(values[0] - target) <= orb
+                window = (None, []) if inside else None
+                for jd, kind in sorted(events):
+                    if kind == "exact":
+                        if window is not None:
+                            window[1].append(jd)
+                    elif window is None:
+                        window = (jd, [])
+                    else:
+                        windows.append((a, b, aspect, window[0], jd, window[1]))
+                        window = None
+                if window is not None:
+                    windows.append((a, b, aspect, window[0], None, window[1]))
+
+    return sorted(windows, key=lambda w: start_jd if w[3] is None else w[3])
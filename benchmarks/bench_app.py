@@ -0,0 +1,58 @@
+import pytest
+
+subject = "year=1990&month=9&day=5&hour=15&lat=55.3948&lon=43.8399"
+partner = "year2=1992&month2=3&day2=1&hour2=8&lat2=51.5&lon2=-0.1"
+
+routes = [
+    ("GET", f"/planetary_positions?{subject}"),
+    ("GET", "/planetary_positions/range?start=2024-01-01&end=2024-12-31"),
+    ("GET", "/retrograde_calendar?n=24&lat=55.3948&lon=43.8399"),
+    ("GET", f"/natal.json?{subject}"),
+    ("GET", f"/natal.json?{subject}&fields=objects"),
+    ("GET", f"/natal.txt?{subject}"),
+    ("POST", f"/transits?{subject}"),
+    ("POST", f"/progressions?{subject}"),
+    ("POST", f"/synastry?{subject}&{partner}"),
+    ("POST", f"/composite?{subject}&{partner}"),
+    ("POST", f"/solar_returns?{subject}&solar_return_year=2024"),
+    ("GET", "/get_daily_forecast_data?start_date=2024-03-19"),
+    ("GET", "/get_weekly_forecast_data?start_date=2024-03-19"),
+    ("GET", "/get_yearly_forecast_data?start_date=2024-03-19"),
+    ("GET", "/ephemeris_table?start_date=2024-01-01&end_date=2024-12-31"),
+]
+
+
+@pytest.mark.parametrize("method,url", routes, ids=[url for _, url in routes])
+def test_route(client, uncached, method, url):
+    def request():
+        response = client.request(method, url)
+        assert response.status_code == 200
+        return response
+
+    uncached(request)
+
+
+def test_cached_natal_json(client, benchmark):
+    url = f"/natal.json?{subject}"
+    assert client.get(url).status_code == 200
+
+    def request():
+        response = client.get(url)
+        assert response.status_code == 200
+        return response
+
+    benchmark(request)
+
+
+def test_natal_batch(client, uncached):
+    subjects = [
+        {"id": i, "year": 1950 + i, "month": 6, "day": 1, "lat": 51.5, "lon": -0.1}
+        for i in range(64)
+    ]
+
+    def request():
+        response = client.post("/natal/batch", json={"subjects": subjects})
+        assert response.status_code == 200
+        return response
+
+    uncached(request, rounds=3)
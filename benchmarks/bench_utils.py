@@ -0,0 +1,127 @@
+import itertools
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from immanuel import charts
+from immanuel.const import chart
+from immanuel.tools import date
+
+import utils
+import workers
+from ephemeris_index import EphemerisIndex
+from positions import PositionTable
+
+start = datetime(2024, 3, 19)
+start_jd = date.to_jd(start)
+
+
+@pytest.fixture(scope="module")
+def year_index():
+    return EphemerisIndex.build(start_jd, start_jd + 364)
+
+
+def test_retrograde_periods(benchmark):
+    benchmark(utils.retrograde_periods, 24, 55.3948, 43.8399, start)
+
+
+def test_day_forecast(benchmark):
+    benchmark(utils.day_forecast, start)
+
+
+def test_daily_forecast_data(benchmark):
+    benchmark.pedantic(
+        utils.daily_forecast_data,
+        args=(start,),
+        setup=utils.day_store.memory.clear,
+        rounds=10,
+    )
+
+
+def test_weekly_forecast_data(benchmark):
+    benchmark.pedantic(
+        utils.weekly_forecast_data,
+        args=(start,),
+        setup=utils.day_store.memory.clear,
+        rounds=5,
+    )
+
+
+def test_aspect_timeline_week(benchmark):
+    benchmark(utils.aspect_timeline_data, start, 7)
+
+
+def test_aspect_timeline_year(benchmark):
+    benchmark.pedantic(utils.aspect_timeline_data, args=(start, 365), rounds=3)
+
+
+def test_yearly_forecast_data(benchmark):
+    benchmark(utils.yearly_forecast_data, start)
+
+
+def test_indexed_yearly_forecast_data(benchmark, year_index):
+    benchmark(utils.indexed_yearly_forecast_data, year_index, start)
+
+
+def test_forecast_periods(benchmark, year_index):
+    events = year_index.changes("sign", utils.planets[0], start_jd, start_jd + 364)
+    changes = utils.daily_changes(start_jd, 365, events)
+    benchmark(utils.forecast_periods, start, 365, 1, changes)
+
+
+def test_position_table(benchmark):
+    benchmark(PositionTable, start_jd + np.arange(365), utils.planets)
+
+
+def test_ephemeris_table_data(benchmark):
+    benchmark(utils.ephemeris_table_data, start, datetime(2025, 3, 19))
+
+
+def test_position_rows(benchmark):
+    benchmark(lambda: sum(1 for _ in utils.position_rows(start, datetime(2025, 3, 19))))
+
+
+def natal_planet_positions(date_time, lat, lon):
+    """/planetary_positions before the fast path: a whole natal chart,
+    filtered down to the planets."""
+    natal = charts.Natal(charts.Subject(date_time, lat, lon))
+    return [
+        {
+            "name": obj.name,
+            "latitude": obj.latitude.formatted,
+            "longitude": obj.longitude.formatted,
+            "sign": obj.sign.name,
+            "sign_longitude": obj.sign_longitude.formatted,
+            "house": obj.house.name,
+            "speed": obj.speed,
+            "distance": obj.distance,
+            "movement": obj.movement.formatted,
+        }
+        for obj in natal.objects.values()
+        if obj.type.index == chart.PLANET
+    ]
+
+
+def peak_kib(fn, *args):
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+@pytest.mark.parametrize(
+    "positions", [natal_planet_positions, workers.planet_positions]
+)
+def test_planet_positions(benchmark, positions):
+    # A new minute every call, so immanuel's per-jd caches never hit
+    minutes = itertools.count()
+
+    def run():
+        moment = datetime(1990, 9, 5, 15) + timedelta(minutes=next(minutes))
+        return positions(moment, 55.3948, 43.8399)
+
+    run()
+    benchmark.extra_info["peak_kib"] = peak_kib(run)
+    benchmark(run)
@@ -0,0 +1,63 @@
+"""
+Compares two benchmark result files and exits non-zero if any timing got
+slower by more than the threshold. Accepts pytest-benchmark JSON (from
+--benchmark-json, compared on median) and benchmarks.load output (compared
+on p50/p95/p99 per concurrency level, and on throughput).
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+"""
+
+import argparse
+import json
+import sys
+
+
+def timings(results):
+    """Flattens a result file to {name: (value, higher_is_better)}."""
+    values = {}
+    for bench in results.get("benchmarks", []):
+        values[bench["fullname"]] = (bench["stats"]["median"], False)
+    for level in results.get("load", []):
+        prefix = f"load c={level['concurrency']}"
+        for key in ("p50", "p95", "p99"):
+            values[f"{prefix} {key}"] = (level[key], False)
+        values[f"{prefix} throughput"] = (level["throughput"], True)
+    return values
+
+
+def compare(before, after, threshold):
+    """Returns (name, before, after, change, regressed) for every timing
+    present in both files. change is the relative slowdown."""
+    rows = []
+    for name, (old, higher_is_better) in before.items():
+        if name not in after:
+            continue
+        new = after[name][0]
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        rows.append((name, old, new, change, change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = timings(json.load(f))
+    with open(args.after) as f:
+        after = timings(json.load(f))
+
+    rows = compare(before, after, args.threshold)
+    for name, old, new, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<70} {old:12.6f} {new:12.6f} {change:+8.1%} {flag}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+
+os.environ.setdefault("SE_EPHE_PATH", "./data")
+# The session client sends every benchmark round from one address, which
+# must not run out of quota part way through
+os.environ.setdefault("ADMISSION_RATE", "1e9")
+os.environ.setdefault("ADMISSION_BURST", "1e9")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from caching import response_cache
+from utils import day_store
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def uncached(benchmark):
+    """Benchmarks fn with the response cache and the in-memory forecast
+    store emptied before every round, so routes are measured computing
+    rather than serving stored results."""
+
+    def clear():
+        response_cache.local.clear()
+        day_store.memory.clear()
+
+    def run(fn, *args, rounds=5):
+        return benchmark.pedantic(fn, args=args, setup=clear, rounds=rounds)
+
+    return run
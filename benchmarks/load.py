@@ -0,0 +1,96 @@
+"""
+Load generator: replays a mix of requests against the in-process app at
+several concurrency levels and reports latency percentiles and throughput.
+
+    python -m benchmarks.load --concurrency 1,4,16 --requests 200 --output load.json
+
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("SE_EPHE_PATH", "./data")
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app import app
+from caching import response_cache
+from utils import day_store
+
+default_urls = [
+    "/natal.json?year={year}&month=9&day=5&hour=15&lat=55.3948&lon=43.8399",
+    "/planetary_positions?year={year}&month=9&day=5&hour=15&lat=55.3948&lon=43.8399",
+    "/retrograde_calendar?n=24&lat=55.3948&lon=43.8399",
+    "/get_daily_forecast_data?start_date={year}-03-19",
+    "/get_weekly_forecast_data?start_date={year}-03-19",
+    "/get_yearly_forecast_data?start_date={year}-03-19",
+]
+
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+def run_level(client, urls, concurrency, requests):
+    """Sends requests GETs cycling through urls from concurrency threads.
+    {year} in a url is filled in per request, so that cached responses
+    only repeat once the years wrap around."""
+    response_cache.local.clear()
+    day_store.memory.clear()
+
+    def fetch(i):
+        url = urls[i % len(urls)].format(year=1900 + i // len(urls) % 200)
+        started = time.perf_counter()
+        response = client.get(url)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in results]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(1 for _, code in results if code != 200),
+        "throughput": requests / elapsed,
+        **percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--url", action="append", help="Repeatable, default: mix")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    levels = []
+    with TestClient(app) as client:
+        for concurrency in map(int, args.concurrency.split(",")):
+            level = run_level(
+                client, args.url or default_urls, concurrency, args.requests
+            )
+            levels.append(level)
+            print(
+                f"c={concurrency:<4} {level['throughput']:8.1f} req/s"
+                f"  p50 {level['p50'] * 1000:8.1f} ms"
+                f"  p95 {level['p95'] * 1000:8.1f} ms"
+                f"  p99 {level['p99'] * 1000:8.1f} ms"
+                f"  errors {level['errors']}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"load": levels}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Response cache for the chart endpoints. Chart responses are pure functions
+of their query parameters, so they are stored as the final serialized bytes
+under a hash of the normalized parameters: a hit skips both the chart
+computation and the JSON encoding.
+
+Entries live in an in-process LRU and, if configured, in a shared backend
+(Redis, or MemoryBackend as a local stand-in) so that several workers can
+share their results.
+
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from importlib.metadata import version
+from fastapi.responses import Response
+import formats
+import serializer
+from singleflight import SingleFlight
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryBackend:
+    """In-process stand-in for a shared backend, with the same interface
+    as RedisBackend."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, self.clock() + ttl if ttl else None)
+
+
+class RedisBackend:
+    def __init__(self, url, prefix="immanuel-api:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+
+class ResponseCache:
+    def __init__(self, local, shared=None, ttl=None):
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["size"] = len(self.local)
+        return stats
+
+
+# Cached bytes are only valid for the library that computed them
+key_salt = f"immanuel={version('immanuel')}"
+
+
+def cache_key(route, params):
+    normalized = json.dumps([key_salt, route, sorted(params.items())], default=str)
+    return f"{route}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+# Concurrent misses for the same key wait for one computation
+flights = SingleFlight()
+
+
+def cached(cache, media_type="application/json", ignore=("x_token",), offered=None):
+    """Decorates a sync or async route handler so that its serialized
+    response is served from cache. Handlers may return plain content or a
+    Response. Identical requests arriving while the response is being
+    computed share that computation.
+
+    With offered, a tuple of media types, the response is in the one the
+    request's accept parameter negotiates (see formats), cached separately
+    for each, and plain content is encoded in it."""
+
+    def decorator(handler):
+        def negotiate(params):
+            if offered is None:
+                return media_type
+            return formats.negotiate(params.get("accept"), offered)
+
+        def key_for(params, media):
+            params = {k: v for k, v in params.items() if k not in ignore}
+            if offered is not None:
+                params["accept"] = media
+            return cache_key(handler.__name__, params)
+
+        def store(key, media, result):
+            if isinstance(result, Response):
+                # Errors are returned as they are and never cached
+                if result.status_code != 200:
+                    return result
+                body = result.body
+            else:
+                body = serializer.encode(result, media_type=media)
+            cache.set(key, body)
+            return body
+
+        def respond(body, media):
+            if isinstance(body, Response):
+                return body
+            headers = {"Vary": "Accept"} if offered is not None else None
+            return Response(content=body, media_type=media, headers=headers)
+
+        if inspect.iscoroutinefunction(handler):
+
+            async def compute(key, media, params):
+                return store(key, media, await handler(**params))
+
+            @functools.wraps(handler)
+            async def wrapper(**params):
+                media = negotiate(params)
+                key = key_for(params, media)
+                body = cache.get(key)
+                if body is None:
+                    body = await flights.run(key, compute, key, media, params)
+                return respond(body, media)
+
+        else:
+
+            def compute(key, media, params):
+                return store(key, media, handler(**params))
+
+            @functools.wraps(handler)
+            def wrapper(**params):
+                media = negotiate(params)
+                key = key_for(params, media)
+                body = cache.get(key)
+                if body is None:
+                    body = flights.do(key, compute, key, media, params)
+                return respond(body, media)
+
+        return wrapper
+
+    return decorator
+
+
+def from_environment():
+    ttl = int(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+    redis_url = os.getenv("RESPONSE_CACHE_REDIS_URL")
+    return ResponseCache(
+        local=LRUCache(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 1024)), ttl=ttl),
+        shared=RedisBackend(redis_url) if redis_url else None,
+        ttl=ttl,
+    )
+
+
+response_cache = from_environment()
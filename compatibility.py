@@ -0,0 +1,123 @@
+"""
+Many-to-many synastry scoring. Each subject's Sun to Pluto longitudes are
+computed once, then the inter-aspects of every pair are found at once with
+array math over the angular differences, using the same aspects, orbs and
+orb averaging as immanuel's default synastry charts.
+
+"""
+
+from datetime import datetime
+import numpy as np
+from immanuel import charts
+from immanuel.const import calc, chart
+from immanuel.setup import settings as default_settings
+from positions import PositionTable, timezone_at
+
+bodies = [
+    chart.SUN,
+    chart.MOON,
+    chart.MERCURY,
+    chart.VENUS,
+    chart.MARS,
+    chart.JUPITER,
+    chart.SATURN,
+    chart.URANUS,
+    chart.NEPTUNE,
+    chart.PLUTO,
+]
+
+# Harmonious aspects add to a pair's score, challenging ones subtract,
+# each weighted by how close to exact it is
+aspect_weights = {
+    calc.CONJUNCTION: 1.0,
+    calc.TRINE: 1.0,
+    calc.SEXTILE: 1.0,
+    calc.SQUARE: -1.0,
+    calc.OPPOSITION: -1.0,
+    calc.QUINCUNX: -0.5,
+}
+
+# Upper bound on pair × body × body elements evaluated at once
+chunk_elements = 2_000_000
+
+
+def longitudes(subjects):
+    """(len(subjects), len(bodies)) array of longitudes. Subjects are
+    dicts with year, month, day, hour, lat and lon."""
+    jds = [
+        charts.Subject(
+            datetime(s["year"], s["month"], s["day"], s.get("hour", 0)),
+            s["lat"],
+            s["lon"],
+            timezone=timezone_at(s["lat"], s["lon"]),
+        ).julian_date
+        for s in subjects
+    ]
+    return PositionTable(jds, bodies).longitude.T
+
+
+def orb_table(settings):
+    """(len(aspects), len(bodies), len(bodies)) orbs for each aspect and
+    body pair, combined the way settings.orb_calculation says."""
+    orbs = np.array(
+        [
+            [settings.orbs[body][aspect] for body in bodies]
+            for aspect in settings.aspects
+        ]
+    )
+    if settings.orb_calculation == calc.MEAN:
+        return (orbs[:, :, None] + orbs[:, None, :]) / 2
+    return np.maximum(orbs[:, :, None], orbs[:, None, :])
+
+
+def aspect_matrix(rows, columns, settings=default_settings):
+    """Aspect counts and scores between every row and column subject, as
+    (rows, columns) arrays: total, harmonious and challenging counts and
+    the summed score."""
+    aspects = np.array(settings.aspects)
+    orbs = orb_table(settings)
+    weights = np.array([aspect_weights.get(aspect, 0.0) for aspect in aspects])
+    shape = (len(rows), len(columns))
+    total = np.zeros(shape, dtype=np.int32)
+    harmonious = np.zeros(shape, dtype=np.int32)
+    challenging = np.zeros(shape, dtype=np.int32)
+    score = np.zeros(shape)
+
+    step = max(1, chunk_elements // max(1, len(columns) * len(bodies) ** 2))
+    for start in range(0, len(rows), step):
+        chunk = rows[start : start + step]
+        # (chunk, columns, body, body) separation folded into [0, 180]
+        separation = np.abs(chunk[:, None, :, None] - columns[None, :, None, :]) % 360
+        separation = np.minimum(separation, 360 - separation)
+        # Like immanuel, each body pair takes the first aspect that fits
+        found = np.zeros(separation.shape, dtype=bool)
+        for i, aspect in enumerate(aspects):
+            difference = np.abs(separation - aspect)
+            match = (difference <= orbs[i]) & ~found
+            found |= match
+            count = match.sum(axis=(2, 3))
+            total[start : start + step] += count
+            if weights[i] > 0:
+                harmonious[start : start + step] += count
+            elif weights[i] < 0:
+                challenging[start : start + step] += count
+            closeness = np.where(match, 1 - difference / orbs[i], 0.0)
+            score[start : start + step] += weights[i] * closeness.sum(axis=(2, 3))
+
+    return total, harmonious, challenging, score
+
+
+def matrix_data(subjects, others=None):
+    """Compatibility of every subject with every one of others (or with
+    each other), keyed by the subjects' ids."""
+    rows = longitudes(subjects)
+    columns = rows if others is None else longitudes(others)
+    total, harmonious, challenging, score = aspect_matrix(rows, columns)
+    return {
+        "rows": [s["id"] for s in subjects],
+        "columns": [s["id"] for s in (subjects if others is None else others)],
+        "aspects": total.tolist(),
+        "harmonious": harmonious.tolist(),
+        "challenging": challenging.tolist(),
+        "score": np.round(score, 3).tolist(),
+    }
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+Precomputed index of the caller-independent events behind the calendar
+endpoints: movement changes and sign ingresses of each planet, plus changes
+of the Placidus house each planet occupies at 00:00 UT as seen from (0, 0),
+which is the chart every forecast is cast for.
+
+Events are stored as sorted per-planet arrays so that any range can be
+answered with a binary search. Build it once with:
+
+    python ephemeris_index.py --start-year 1900 --end-year 2100
+
+Ranges outside the built index are covered by timeline(), which builds
+fixed blocks of block_days on demand, memoizes them and joins the ones a
+range needs.
+
+"""
+
+import argparse
+import functools
+import math
+import os
+from datetime import datetime
+import numpy as np
+from immanuel.tools import date
+from events import find_ingress, find_stations
+from positions import PositionTable, cusp_table, house_numbers
+
+index_path = os.getenv(
+    "EPHEMERIS_INDEX_PATH", os.path.join("data", "ephemeris_index.npz")
+)
+
+kinds = ("movement", "sign", "house")
+
+# Bumped whenever the stored arrays change meaning, older files are ignored
+format_version = 2
+
+# Timeline blocks start at 2000-01-01 00:00 UT plus a multiple of block_days
+epoch_jd = 2451544.5
+block_days = 366
+
+
+class EphemerisIndex:
+    def __init__(self, start_jd, end_jd, arrays):
+        self.start_jd = start_jd
+        self.end_jd = end_jd
+        self.arrays = arrays
+
+    @classmethod
+    def build(cls, start_jd, end_jd):
+        days = int(end_jd - start_jd) + 1
+        jds = start_jd + np.arange(days)
+        table = PositionTable(jds)
+        cusps = cusp_table(jds, 0.0, 0.0)
+
+        arrays = {}
+        for row, obj in enumerate(table.objects):
+            lon, signs = table.longitude[row], table.sign[row]
+            houses = house_numbers(lon, cusps)
+            # The first event of each kind is the state at start_jd
+            events = {
+                "sign": [(start_jd, int(signs[0]))],
+                "movement": [(start_jd, int(table.movement[row, 0]))],
+                "house": [(start_jd, int(houses[0]))],
+            }
+            for day in (signs[1:] != signs[:-1]).nonzero()[0].tolist():
+                events["sign"].append(
+                    find_ingress(obj, jds[day], jds[day + 1], lon[day], lon[day + 1])
+                )
+            events["movement"] += find_stations(obj, start_jd, end_jd)
+            # Houses are only sampled at midnights, so a change is dated at
+            # the first sample that shows it
+            for day in ((houses[1:] != houses[:-1]).nonzero()[0] + 1).tolist():
+                events["house"].append((jds[day], int(houses[day])))
+            for kind in kinds:
+                event_jds, values = zip(*events[kind])
+                arrays[f"{kind}_jd_{obj}"] = np.array(event_jds, dtype=np.float64)
+                arrays[f"{kind}_value_{obj}"] = np.array(values, dtype=np.int8)
+
+        return cls(start_jd, end_jd, arrays)
+
+    @classmethod
+    def join(cls, indexes):
+        """Concatenates indexes where each one starts where the previous
+        one ends. The state events that open every index but the first
+        restate what the events before them already imply, so they are
+        dropped."""
+        first = indexes[0]
+        arrays = {}
+        for key in first.arrays:
+            arrays[key] = np.concatenate(
+                [first.arrays[key]] + [index.arrays[key][1:] for index in indexes[1:]]
+            )
+        return cls(first.start_jd, indexes[-1].end_jd, arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        if "version" not in arrays or int(arrays.pop("version")) != format_version:
+            raise ValueError(f"{path} was built by an older version, rebuild it")
+        start_jd, end_jd = arrays.pop("span")
+        return cls(float(start_jd), float(end_jd), arrays)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            version=np.array(format_version),
+            span=np.array([self.start_jd, self.end_jd]),
+            **self.arrays,
+        )
+
+    def covers(self, start_jd, end_jd):
+        return self.start_jd <= start_jd and end_jd <= self.end_jd
+
+    def state_at(self, kind, obj, jd):
+        """Value in force at jd, ie. set by the last event at or before it."""
+        jds = self.arrays[f"{kind}_jd_{obj}"]
+        return int(
+            self.arrays[f"{kind}_value_{obj}"][jds.searchsorted(jd, "right") - 1]
+        )
+
+    def changes(self, kind, obj, start_jd, end_jd):
+        """(jd, value) events falling in (start_jd, end_jd]."""
+        jds = self.arrays[f"{kind}_jd_{obj}"]
+        lo, hi = jds.searchsorted([start_jd, end_jd], "right")
+        values = self.arrays[f"{kind}_value_{obj}"]
+        return [(float(jds[i]), int(values[i])) for i in range(lo, hi)]
+
+
+_index = None
+_loaded = False
+
+
+def load(path=index_path):
+    """(Re)loads the on-disk index. Missing files are not an error, callers
+    simply fall back to computing events on the fly."""
+    global _index, _loaded
+    _index = EphemerisIndex.load(path) if os.path.exists(path) else None
+    _loaded = True
+    return _index
+
+
+def current():
+    if not _loaded:
+        load()
+    return _index
+
+
+@functools.lru_cache(maxsize=int(os.getenv("TIMELINE_BLOCKS", 64)))
+def block(number):
+    start_jd = epoch_jd + number * block_days
+    return EphemerisIndex.build(start_jd, start_jd + block_days)
+
+
+def timeline(start_jd, end_jd):
+    """An index covering start_jd..end_jd: the loaded one if it does,
+    otherwise the memoized blocks around the range joined together."""
+    index = current()
+    if index is not None and index.covers(start_jd, end_jd):
+        return index
+    first = math.floor((start_jd - epoch_jd) / block_days)
+    last = math.ceil((end_jd - epoch_jd) / block_days) - 1
+    return EphemerisIndex.join([block(n) for n in range(first, max(first, last) + 1)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--start-year", type=int, default=1900)
+    parser.add_argument("--end-year", type=int, default=2100)
+    parser.add_argument("--output", default=index_path)
+    args = parser.parse_args()
+
+    index = EphemerisIndex.build(
+        date.to_jd(datetime(args.start_year, 1, 1)),
+        date.to_jd(datetime(args.end_year + 1, 1, 1)),
+    )
+    index.save(args.output)
+    print(f"Saved {args.start_year}-{args.end_year} index to {args.output}")
@@ -0,0 +1,90 @@
+import numpy as np
+import swisseph as swe
+from immanuel.const import chart, calc
+from positions import PositionTable, swe_planets
+
+# Coarse speed sampling step (in days) per planet. Each must stay well below
+# the planet's shortest retrograde period so no station pair is skipped.
+station_steps = {
+    chart.MERCURY: 4,
+    chart.VENUS: 8,
+    chart.MARS: 8,
+    chart.JUPITER: 16,
+    chart.SATURN: 16,
+    chart.URANUS: 16,
+    chart.NEPTUNE: 16,
+    chart.PLUTO: 16,
+}
+
+# Stations and ingresses are refined to well under a second
+tolerance = 1e-6
+
+
+def planet_position(index, jd):
+    """Raw (lon, lat, dist, lon speed, lat speed, dist speed) of a planet. Calls pyswisseph directly
+    so that root finding doesn't fill immanuel's per-jd function caches."""
+    return swe.calc_ut(jd, swe_planets[index])[0]
+
+
+def sign_number(lon):
+    return int(lon / 30) + 1
+
+
+def bisect_root(f, a, b, fa=None):
+    """Bisects a sign change of f inside [a, b] down to the tolerance."""
+    fa = f(a) if fa is None else fa
+    while b - a > tolerance:
+        m = (a + b) / 2
+        fm = f(m)
+        if (fm < 0) == (fa < 0):
+            a, fa = m, fm
+        else:
+            b = m
+    return b
+
+
+def find_stations(index, start_jd, end_jd):
+    """Returns a sorted list of (jd, movement) tuples, one for each moment
+    in (start_jd, end_jd] where the planet's movement changes. Speed is
+    sampled coarsely and each threshold crossing is then bisected."""
+    grid = np.append(np.arange(start_jd, end_jd, station_steps[index]), end_jd)
+    speeds = PositionTable(grid, [index]).speed[0]
+    events = []
+
+    def speed(jd):
+        return planet_position(index, jd)[3]
+
+    samples = zip(grid.tolist(), speeds.tolist())
+    jd, v = next(samples)
+    for next_jd, next_v in samples:
+        for level in (-calc.STATION_SPEED, calc.STATION_SPEED):
+            falling = v > level
+            if falling != (next_v > level):
+                root = bisect_root(lambda t: speed(t) - level, jd, next_jd, v - level)
+                if level < 0:
+                    movement = calc.RETROGRADE if falling else calc.STATIONARY
+                else:
+                    movement = calc.STATIONARY if falling else calc.DIRECT
+                events.append((root, movement))
+        jd, v = next_jd, next_v
+
+    return sorted(events)
+
+
+def find_ingress(index, jd, next_jd, lon, next_lon):
+    """Returns the (jd, sign) of the sign boundary crossing between two
+    samples of a planet's longitude, or None if the sign didn't change."""
+    sign, next_sign = sign_number(lon), sign_number(next_lon)
+    if sign == next_sign:
+        return None
+    # The crossed boundary is the first degree of whichever sign comes later
+    # in zodiacal order
+    forward = swe.difdeg2n(next_lon, lon) > 0
+    boundary = (next_sign - 1) * 30 if forward else (sign - 1) * 30
+    root = bisect_root(
+        lambda t: swe.difdeg2n(planet_position(index, t)[0], boundary),
+        jd,
+        next_jd,
+        swe.difdeg2n(lon, boundary),
+    )
+    return root, next_sign
@@ -0,0 +1,78 @@
+"""
+Per-day store for the daily forecast. The forecast chart is always cast for
+00:00 at (0, 0), so its result depends on the date alone: each day is
+computed once, kept in a bounded in-memory LRU and, optionally, written
+through to a local SQLite file that survives restarts.
+
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime, time, timedelta
+from importlib.metadata import version
+from caching import LRUCache
+from singleflight import SingleFlight
+
+
+class ForecastStore:
+    def __init__(self, compute, maxsize=1024, path=None):
+        self.compute = compute
+        self.memory = LRUCache(maxsize=maxsize)
+        # Concurrent requests for a day that isn't stored yet compute it once
+        self.flights = SingleFlight()
+        self.version = version("immanuel")
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS forecasts"
+                " (version TEXT, day TEXT, data TEXT, PRIMARY KEY (version, day))"
+            )
+            self._db.commit()
+
+    def _load(self, day):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM forecasts WHERE version = ? AND day = ?",
+                (self.version, day),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, day, data):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?)",
+                (self.version, day, json.dumps(data)),
+            )
+            self._db.commit()
+
+    def get(self, date_time):
+        """Forecast for a datetime. Only midnights are memoized, other
+        times are passed straight through to compute. The returned dict is
+        shared, callers must not modify it."""
+        if date_time.time() != time.min:
+            return self.compute(date_time)
+        day = date_time.strftime("%Y-%m-%d")
+        data = self.memory.get(day)
+        if data is None:
+            data = self.flights.do(day, self._fill, day, date_time)
+        return data
+
+    def _fill(self, day, date_time):
+        data = self._load(day)
+        if data is None:
+            data = self.compute(date_time)
+            self._save(day, data)
+        self.memory.set(day, data)
+        return data
+
+    def prewarm(self, start_date, days):
+        start = datetime.combine(start_date, time.min)
+        for i in range(days):
+            self.get(start + timedelta(days=i))
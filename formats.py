@@ -0,0 +1,138 @@
+"""
+Content negotiation for the binary response formats. Routes offer a list of
+media types and the client's Accept header picks one, JSON being the
+default:
+
+- application/msgpack: the same document as the JSON response, as
+  MessagePack.
+- application/vnd.apache.arrow.stream: tabular results as an Arrow IPC
+  stream, one row per record with numbers kept as raw floats and dates as
+  date columns.
+
+"""
+
+import io
+import itertools
+from datetime import date, datetime
+
+import pyarrow
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+aliases = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/vnd.apache.arrow.file": ARROW,
+}
+
+
+def accepted(accept):
+    """{media type or wildcard: q} from an Accept header."""
+    qualities = {}
+    for entry in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_type = aliases.get(media_type.lower(), media_type.lower())
+        qualities[media_type] = max(q, qualities.get(media_type, 0.0))
+    return qualities
+
+
+def negotiate(accept, offered=(JSON, MSGPACK)):
+    """The one of offered the Accept header prefers, the first of offered
+    if it accepts none of them or doesn't say."""
+    qualities = accepted(accept)
+    best, best_q = offered[0], 0.0
+    for media_type in offered:
+        q = qualities.get(
+            media_type,
+            qualities.get(media_type.split("/")[0] + "/*", qualities.get("*/*", 0.0)),
+        )
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def arrow_stream(batches):
+    """Yields an Arrow IPC stream, one chunk per record batch, for a
+    iterable of record batches sharing one schema (nothing if it's empty)."""
+    sink = io.BytesIO()
+    writer = None
+    for batch in batches:
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield pop(sink)
+    if writer is not None:
+        writer.close()
+        yield pop(sink)
+
+
+def pop(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def record_batch(rows):
+    """A record batch of a list of row dicts. String columns (planet, sign
+    and so on, which repeat a handful of values) are dictionary encoded."""
+    batch = pyarrow.RecordBatch.from_pylist(rows)
+    columns = [
+        column.dictionary_encode() if pyarrow.types.is_string(column.type) else column
+        for column in batch.columns
+    ]
+    return pyarrow.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def record_batches(rows, size=4096):
+    """Record batches of up to size rows from an iterable of row dicts."""
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield record_batch(chunk)
+
+
+def arrow_bytes(rows):
+    """Arrow IPC stream of a list of row dicts."""
+    return b"".join(arrow_stream([record_batch(rows)]))
+
+
+def period_rows(periods):
+    """Rows of yearly_forecast_data: one per planet, kind and period."""
+    rows = []
+    for planet, kinds in periods.items():
+        for kind, spans in kinds.items():
+            for span in spans:
+                start, end = span["period"].split(" - ")
+                rows.append(
+                    {
+                        "planet": planet,
+                        "kind": kind,
+                        "start": date.fromisoformat(start),
+                        "end": date.fromisoformat(end),
+                        "value": span["value"],
+                    }
+                )
+    return rows
+
+
+def column_rows(table):
+    """Rows of ephemeris_table_data: one per sample and planet."""
+    rows = []
+    for i, sample in enumerate(table["date"]):
+        for planet, columns in table["planets"].items():
+            row = {"date": datetime.fromisoformat(sample), "planet": planet}
+            row.update((name, values[i]) for name, values in columns.items())
+            rows.append(row)
+    return rows
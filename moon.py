@@ -0,0 +1,220 @@
+"""
+Moon calendar: exact times of the four main lunar phases, the Moon's sign
+ingresses and its void-of-course periods. The Sun, Moon and planets are
+sampled daily with PositionTable and every crossing found on that grid is
+refined to its exact time with Newton's method, on the Sun-Moon elongation
+for phases, the Moon's longitude for ingresses and the Moon-planet
+elongations for aspects.
+
+The Moon is faster than every other body, so each of these elongations only
+ever increases: a crossing can't hide between two samples and Newton's
+method converges in a few steps from the middle of the interval.
+
+Events are computed one calendar year at a time and each year is memoized,
+so any range is answered from the years around it.
+
+"""
+
+import bisect
+import functools
+import os
+from datetime import datetime
+import numpy as np
+import swisseph as swe
+from immanuel.const import calc, chart, names
+from immanuel.tools import date
+from events import tolerance
+from positions import PositionTable, swe_bodies
+
+# Grid step in days. The Moon moves at most ~15.4° a day relative to any
+# other body, so it crosses at most one sign boundary per step.
+step = 1.0
+max_iterations = 20
+
+# Exact elongation of each phase, named as in names.MOON_PHASES
+phases = {
+    0.0: calc.NEW_MOON,
+    90.0: calc.FIRST_QUARTER,
+    180.0: calc.FULL_MOON,
+    270.0: calc.THIRD_QUARTER,
+}
+
+# The Moon is void of course from its last major aspect to one of these
+# bodies until it leaves its sign
+void_bodies = [
+    chart.SUN,
+    chart.MERCURY,
+    chart.VENUS,
+    chart.MARS,
+    chart.JUPITER,
+    chart.SATURN,
+    chart.URANUS,
+    chart.NEPTUNE,
+    chart.PLUTO,
+]
+
+# Moon-body elongations of the major aspects
+void_aspects = {
+    0.0: calc.CONJUNCTION,
+    60.0: calc.SEXTILE,
+    90.0: calc.SQUARE,
+    120.0: calc.TRINE,
+    180.0: calc.OPPOSITION,
+    240.0: calc.TRINE,
+    270.0: calc.SQUARE,
+    300.0: calc.SEXTILE,
+}
+
+# The Moon never spends more than ~2.8 days in a sign, so a void period
+# never starts more than that before the ingress ending it
+margin_days = 3
+
+
+def exact(angle, jd, next_jd, body=None):
+    """When the Moon's longitude, minus the body's if given, is angle,
+    between jd and next_jd."""
+    t = (jd + next_jd) / 2
+    for _ in range(max_iterations):
+        moon = swe.calc_ut(t, swe.MOON)[0]
+        lon, speed = moon[0], moon[3]
+        if body is not None:
+            other = swe.calc_ut(t, swe_bodies[body])[0]
+            lon, speed = lon - other[0], speed - other[3]
+        correction = swe.difdeg2n(lon, angle) / speed
+        t -= correction
+        if abs(correction) < tolerance:
+            break
+    return t
+
+
+def crossings(elongations, angles):
+    """(sample, angle) for each of angles that the increasing elongations
+    pass between a sample and the next."""
+    unwrapped = np.unwrap(elongations, period=360)
+    found = []
+    for i in (np.diff(unwrapped // 30) != 0).nonzero()[0].tolist():
+        low, high = unwrapped[i], unwrapped[i + 1]
+        for angle in range(int(np.ceil(low / 30)) * 30, int(high) + 1, 30):
+            if low < angle <= high and angle % 360 in angles:
+                found.append((i, float(angle % 360)))
+    return found
+
+
+class MoonEvents:
+    """Moon events between start_jd and end_jd, as sorted lists of
+    (jd, phase), (jd, sign) and (start_jd, end_jd, sign, body, aspect)."""
+
+    def __init__(self, start_jd, end_jd):
+        self.start_jd = start_jd
+        self.end_jd = end_jd
+        table = PositionTable(
+            np.arange(start_jd - margin_days, end_jd + step, step),
+            [chart.MOON, *void_bodies],
+        )
+        jds = table.jd.tolist()
+        moon = table.longitude[0]
+
+        self.phases = []
+        sun_elongation = moon - table.longitude[table.row(chart.SUN)]
+        for i, angle in crossings(sun_elongation, phases):
+            jd = exact(angle, jds[i], jds[i + 1], chart.SUN)
+            if start_jd <= jd < end_jd:
+                self.phases.append((jd, phases[angle]))
+
+        ingresses = []
+        for i in (table.sign[0][1:] != table.sign[0][:-1]).nonzero()[0].tolist():
+            sign = int(table.sign[0][i + 1])
+            ingresses.append((exact((sign - 1) * 30.0, jds[i], jds[i + 1]), sign))
+        self.ingresses = [
+            (jd, sign) for jd, sign in ingresses if start_jd <= jd < end_jd
+        ]
+
+        # Every aspect crossing, grouped by the grid interval it falls in
+        intervals = {}
+        for body in void_bodies:
+            body_elongation = moon - table.longitude[table.row(body)]
+            for i, angle in crossings(body_elongation, void_aspects):
+                intervals.setdefault(i, []).append((body, angle))
+
+        self.void_of_course = []
+        for (entered, sign), (left, _) in zip(ingresses, ingresses[1:]):
+            if left < start_jd or left >= end_jd:
+                continue
+            last = self.last_aspect(jds, intervals, entered, left)
+            if last is None:
+                self.void_of_course.append((entered, left, sign, None, None))
+            else:
+                jd, body, angle = last
+                self.void_of_course.append((jd, left, sign, body, void_aspects[angle]))
+
+    @staticmethod
+    def last_aspect(jds, intervals, entered, left):
+        """(jd, body, angle) of the last exact aspect between the Moon's
+        ingresses at entered and left. Intervals are bisected latest first,
+        so only the ones near the end of the sign are ever refined."""
+        first = bisect.bisect_right(jds, entered) - 1
+        last = bisect.bisect_right(jds, left) - 1
+        for i in range(last, first - 1, -1):
+            found = [
+                (exact(angle, jds[i], jds[i + 1], body), body, angle)
+                for body, angle in intervals.get(i, [])
+            ]
+            found = [event for event in found if entered <= event[0] < left]
+            if found:
+                return max(found)
+        return None
+
+
+@functools.lru_cache(maxsize=int(os.getenv("MOON_CALENDAR_YEARS", 32)))
+def year_events(year):
+    return MoonEvents(
+        date.to_jd(datetime(year, 1, 1)), date.to_jd(datetime(year + 1, 1, 1))
+    )
+
+
+def utc_iso(jd):
+    return date.to_datetime(jd).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def calendar_data(start_date, end_date):
+    """Moon phases, ingresses and void-of-course periods from start_date up
+    to end_date (naive UTC datetimes). Void periods are included if they
+    overlap the range."""
+    start_jd, end_jd = date.to_jd(start_date), date.to_jd(end_date)
+    years = [year_events(y) for y in range(start_date.year, end_date.year + 1)]
+    # A void period overlapping the end of the range can end in the next year
+    if date.to_jd(datetime(end_date.year + 1, 1, 1)) - end_jd < margin_days:
+        years.append(year_events(end_date.year + 1))
+
+    return {
+        "phases": [
+            {"date_time": utc_iso(jd), "phase": names.MOON_PHASES[phase]}
+            for events in years
+            for jd, phase in events.phases
+            if start_jd <= jd < end_jd
+        ],
+        "ingresses": [
+            {"date_time": utc_iso(jd), "sign": names.SIGNS[sign]}
+            for events in years
+            for jd, sign in events.ingresses
+            if start_jd <= jd < end_jd
+        ],
+        "void_of_course": [
+            {
+                "start": utc_iso(start),
+                "end": utc_iso(end),
+                "sign": names.SIGNS[sign],
+                "last_aspect": (
+                    None
+                    if body is None
+                    else {
+                        "object": names.PLANETS[body],
+                        "aspect": names.ASPECTS[aspect],
+                    }
+                ),
+            }
+            for events in years
+            for start, end, sign, body, aspect in events.void_of_course
+            if start < end_jd and end > start_jd
+        ],
+    }
@@ -0,0 +1,84 @@
+"""
+Planet positions over a grid of Julian days as NumPy arrays, one row per
+planet and one column per sample. Reads raw pyswisseph output instead of
+going through ephemeris.get_objects(), which builds a dict per object per
+sample.
+
+"""
+
+import functools
+import numpy as np
+import swisseph as swe
+from immanuel.const import chart, calc
+from timezonefinder import TimezoneFinder
+
+swe_planets = {
+    chart.MERCURY: swe.MERCURY,
+    chart.VENUS: swe.VENUS,
+    chart.MARS: swe.MARS,
+    chart.JUPITER: swe.JUPITER,
+    chart.SATURN: swe.SATURN,
+    chart.URANUS: swe.URANUS,
+    chart.NEPTUNE: swe.NEPTUNE,
+    chart.PLUTO: swe.PLUTO,
+}
+
+swe_bodies = {chart.SUN: swe.SUN, chart.MOON: swe.MOON, **swe_planets}
+
+
+class PositionTable:
+    def __init__(self, jds, objects=None):
+        self.jd = np.asarray(jds, dtype=np.float64)
+        self.objects = list(objects or swe_planets)
+        values = np.array(
+            [
+                [swe.calc_ut(jd, swe_bodies[obj])[0] for jd in self.jd.tolist()]
+                for obj in self.objects
+            ],
+            dtype=np.float64,
+        ).reshape(len(self.objects), len(self.jd), 6)
+        self.longitude = values[..., 0]
+        self.latitude = values[..., 1]
+        self.distance = values[..., 2]
+        self.speed = values[..., 3]
+        self.sign = (self.longitude // 30).astype(np.int8) + 1
+        self.movement = movements(self.speed)
+
+    def row(self, obj):
+        return self.objects.index(obj)
+
+
+@functools.cache
+def finder():
+    return TimezoneFinder()
+
+
+def timezone_at(lat, lon):
+    """Time zone name at a place. immanuel builds a new TimezoneFinder for
+    every subject that isn't given one, this shares a single finder."""
+    return finder().timezone_at(lat=lat, lng=lon)
+
+
+def movements(speed):
+    """Same classification as ephemeris.object_movement(), for an array."""
+    return np.where(
+        speed > calc.STATION_SPEED,
+        calc.DIRECT,
+        np.where(speed < -calc.STATION_SPEED, calc.RETROGRADE, calc.STATIONARY),
+    ).astype(np.int8)
+
+
+def cusp_table(jds, lat, lon):
+    """Placidus cusps for each jd, shaped (len(jds), 12)."""
+    return np.array(
+        [swe.houses_ex2(jd, lat, lon, b"P")[0] for jd in np.asarray(jds).tolist()],
+        dtype=np.float64,
+    ).reshape(-1, 12)
+
+
+def house_numbers(lon, cusps):
+    """The house each longitude falls in, given one row of cusps per
+    longitude. Same placement rule as immanuel.tools.position.house()."""
+    offset = (lon[:, None] - cusps) % 360
+    width = (np.roll(cusps, -1, axis=1) - cusps) % 360
+    return ((offset < width).argmax(axis=1) + 1).astype(np.int8)
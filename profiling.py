@@ -0,0 +1,235 @@
+"""
+Per-request timing. install() wraps the hot spots (subject and chart
+construction, ephemeris.get_objects, aspect calculation, serialization)
+and counts raw Swiss Ephemeris calls; each request collects these into its
+own Profile, which app.py reports as a Server-Timing header and aggregates
+into Prometheus metrics on /metrics. The wrappers cost something on every
+call in the process, so they are only installed with REQUEST_METRICS=1 (or
+PROFILE_REQUESTS=1); otherwise requests are only timed as a whole.
+
+Work sent to the worker pool runs under collect(), which measures it in the
+worker process and hands the measurements back with the result.
+
+"""
+
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+import swisseph as swe
+from immanuel import charts
+from immanuel.reports import aspect
+from immanuel.tools import ephemeris
+import serializer
+
+# ?profile=1 exposes code internals, so it is off unless explicitly allowed
+allow_profile = os.getenv("PROFILE_REQUESTS", "0") == "1"
+enabled = os.getenv("REQUEST_METRICS", "0") == "1" or allow_profile
+
+_current = contextvars.ContextVar("profile", default=None)
+_installed = False
+
+
+class Profile:
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.durations = {}
+        self.counts = {}
+        self.reports = []
+        self._depth = {}
+
+    @contextmanager
+    def phase(self, name):
+        # Only the outermost of nested same-name phases is timed
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] = depth
+            if depth == 0:
+                elapsed = time.perf_counter() - started
+                self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, measured):
+        for name, elapsed in measured["durations"].items():
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+        for name, n in measured["counts"].items():
+            self.count(name, n)
+        self.reports += measured["reports"]
+
+    def measured(self):
+        return {
+            "durations": self.durations,
+            "counts": self.counts,
+            "reports": self.reports,
+        }
+
+    def server_timing(self):
+        metrics = [
+            f"{name};dur={elapsed * 1000:.1f}"
+            for name, elapsed in self.durations.items()
+        ]
+        metrics += [f'{name};desc="{n}"' for name, n in self.counts.items()]
+        return ", ".join(metrics)
+
+
+def current():
+    return _current.get()
+
+
+def timed(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        with profile.phase(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def counted(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is not None:
+            profile.count(name)
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    charts.Subject.__init__ = timed("subject", charts.Subject.__init__)
+    charts.Chart.__init__ = timed("chart", charts.Chart.__init__)
+    ephemeris.get_objects = timed("objects", ephemeris.get_objects)
+    aspect.all = timed("aspects", aspect.all)
+    aspect.synastry = timed("aspects", aspect.synastry)
+    serializer.dumps = timed("serialize", serializer.dumps)
+    swe.calc_ut = counted("ephemeris_calls", swe.calc_ut)
+    swe.houses_ex2 = counted("ephemeris_calls", swe.houses_ex2)
+
+
+def report(profiler, limit=30):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+@contextmanager
+def request(profile=False):
+    """Collects everything measured in this context into a new Profile,
+    timed as a whole under "total". With profile=True, the calling thread
+    also runs under cProfile."""
+    current = Profile(profile)
+    token = _current.set(current)
+    profiler = cProfile.Profile() if profile else None
+    try:
+        with current.phase("total"):
+            if profiler is None:
+                yield current
+            else:
+                profiler.enable()
+                try:
+                    yield current
+                finally:
+                    profiler.disable()
+                    current.reports.insert(0, report(profiler))
+    finally:
+        _current.reset(token)
+
+
+def collect(fn, args, profile=False, measure=False):
+    """Runs fn(*args) in a fresh Profile and returns (result, measured).
+    This is what the worker pool actually executes, measure tells it whether
+    to install() the wrappers."""
+    if measure:
+        install()
+    with request(profile) as current:
+        result = fn(*args)
+    measured = current.measured()
+    # The worker's own total would double count the request's
+    measured["durations"].pop("total")
+    return result, measured
+
+
+class Metrics:
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.requests = {}
+        self.counts = {}
+        self.phase_seconds = {}
+        self.latency = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, status_code, profile):
+        elapsed = profile.durations.get("total", 0.0)
+        with self._lock:
+            key = (route, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, n in profile.counts.items():
+                self.counts[route, name] = self.counts.get((route, name), 0) + n
+            for name, seconds in profile.durations.items():
+                if name != "total":
+                    key = (route, name)
+                    self.phase_seconds[key] = self.phase_seconds.get(key, 0.0) + seconds
+            buckets, total, count = self.latency.get(
+                route, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    buckets[i] += 1
+            self.latency[route] = (buckets, total + elapsed, count + 1)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE api_requests_total counter")
+            for (route, code), n in sorted(self.requests.items()):
+                lines.append(f'api_requests_total{{route="{route}",code="{code}"}} {n}')
+            for name in sorted({name for _, name in self.counts}):
+                lines.append(f"# TYPE api_{name}_total counter")
+                for (route, counter), n in sorted(self.counts.items()):
+                    if counter == name:
+                        lines.append(f'api_{name}_total{{route="{route}"}} {n}')
+            lines.append("# TYPE api_phase_seconds_total counter")
+            for (route, name), seconds in sorted(self.phase_seconds.items()):
+                lines.append(
+                    f'api_phase_seconds_total{{route="{route}",phase="{name}"}} {seconds}'
+                )
+            lines.append("# TYPE api_request_duration_seconds histogram")
+            for route, (buckets, total, count) in sorted(self.latency.items()):
+                for bound, n in zip(self.buckets, buckets):
+                    lines.append(
+                        f'api_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {n}'
+                    )
+                lines.append(
+                    f'api_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {count}'
+                )
+                lines.append(
+                    f'api_request_duration_seconds_sum{{route="{route}"}} {total}'
+                )
+                lines.append(
+                    f'api_request_duration_seconds_count{{route="{route}"}} {count}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
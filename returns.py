@@ -0,0 +1,121 @@
+"""
+Solar returns for a range of years. The native and its natal Sun are
+computed once, and each year's return is solved with Newton's method on
+the Sun's longitude, seeded from the previous year's return plus a
+tropical year, so it usually converges in one or two steps.
+
+"""
+
+import swisseph as swe
+from immanuel import charts
+from immanuel.const import calc, chart, names
+from immanuel.setup import settings as default_settings
+from immanuel.tools import date, ephemeris
+
+max_iterations = 20
+
+
+def sun(jd):
+    """Raw longitude and speed of the Sun."""
+    position = swe.calc_ut(jd, swe.SUN)[0]
+    return position[0], position[3]
+
+
+def return_jds(native_jd, years):
+    """Julian dates of the Sun's returns to its longitude at native_jd, one
+    for each of the consecutive years."""
+    natal_lon = sun(native_jd)[0]
+    birth_year = date.to_datetime(native_jd).year
+    jd = native_jd + (years[0] - birth_year) * calc.YEAR_DAYS
+    jds = []
+    for _ in years:
+        for _ in range(max_iterations):
+            lon, speed = sun(jd)
+            distance = swe.difdeg2n(natal_lon, lon)
+            if abs(distance) <= calc.MAX_ERROR:
+                break
+            jd += distance / speed
+        jds.append(jd)
+        jd += calc.YEAR_DAYS
+    return jds
+
+
+class SolarReturn(charts.SolarReturn):
+    """charts.SolarReturn for an already solved return moment."""
+
+    def __init__(
+        self,
+        native,
+        year,
+        jd,
+        aspects_to=None,
+        settings=default_settings,
+    ):
+        self._solar_return_jd = jd
+        super().__init__(native, year, aspects_to, settings)
+
+    def generate(self):
+        jd = self._solar_return_jd
+        lat, lon = self._native.latitude, self._native.longitude
+        house_system = self._settings.house_system
+        self._obliquity = ephemeris.earth_obliquity(jd)
+        self._solar_return_armc = ephemeris.get_angle(
+            index=chart.ARMC, jd=jd, lat=lat, lon=lon, house_system=house_system
+        )
+        self._triad[chart.SUN] = ephemeris.get_planet(chart.SUN, jd)
+        self._triad[chart.MOON] = ephemeris.get_planet(chart.MOON, jd)
+        self._triad[chart.ASC] = ephemeris.get_angle(
+            index=chart.ASC, jd=jd, lat=lat, lon=lon, house_system=house_system
+        )
+        self._diurnal = ephemeris.is_daytime_from(
+            self._triad[chart.SUN], self._triad[chart.ASC]
+        )
+        self._moon_phase = ephemeris.moon_phase_from(
+            self._triad[chart.SUN], self._triad[chart.MOON]
+        )
+        self._objects = ephemeris.get_objects(
+            object_list=self._settings.objects,
+            jd=jd,
+            lat=lat,
+            lon=lon,
+            house_system=house_system,
+            part_formula=self._settings.part_formula,
+        )
+        self._houses = ephemeris.get_houses(
+            jd=jd, lat=lat, lon=lon, house_system=house_system
+        )
+
+
+def solar_returns(native, years):
+    """Solar return charts of native for each of the consecutive years."""
+    return [
+        SolarReturn(native, year, jd)
+        for year, jd in zip(years, return_jds(native.julian_date, years))
+    ]
+
+
+def angle(lon):
+    return {
+        "longitude": lon,
+        "sign": names.SIGNS[int(lon // 30) + 1],
+        "sign_longitude": lon % 30,
+    }
+
+
+def return_moments(native, years):
+    """Moment, Ascendant and Midheaven of each year's solar return, without
+    casting the charts."""
+    zone = native.date_time.tzinfo
+    moments = []
+    for year, jd in zip(years, return_jds(native.julian_date, years)):
+        ascmc = swe.houses_ex2(jd, native.latitude, native.longitude, b"P")[1]
+        moments.append(
+            {
+                "year": year,
+                "date_time": date.to_datetime(jd).astimezone(zone).isoformat(),
+                "julian_date": jd,
+                "asc": angle(ascmc[0]),
+                "mc": angle(ascmc[1]),
+            }
+        )
+    return moments
@@ -0,0 +1,117 @@
+"""
+Single-pass JSON serializer for immanuel chart objects. Produces the same
+bytes as json.dumps(chart, cls=ToJSON) with FastAPI's compact separators,
+but lets the encoder walk the chart directly and can restrict the output to
+a subset of the chart's top-level fields.
+
+Set JSON_BACKEND=orjson to encode with orjson instead. Its output is the
+same JSON document, but floats with exponents are written differently
+(1e-5 rather than 1e-05), so it is not byte-identical.
+
+packb() encodes the same document, string keys included, as MessagePack.
+
+"""
+
+import json
+import os
+import msgpack
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+backend = os.getenv("JSON_BACKEND", "json")
+
+
+def public_attributes(o):
+    """Mirrors immanuel's ToJSON: public instance attributes, or str()."""
+    if hasattr(o, "__json__"):
+        return o.__json__()
+    if hasattr(o, "__dict__"):
+        return {k: v for k, v in o.__dict__.items() if k[0] != "_"}
+    return str(o)
+
+
+_encoder = json.JSONEncoder(
+    default=public_attributes,
+    ensure_ascii=False,
+    allow_nan=False,
+    separators=(",", ":"),
+)
+
+
+def encode_json(content):
+    return _encoder.encode(content).encode("utf-8")
+
+
+def encode_orjson(content):
+    return orjson.dumps(
+        content,
+        default=public_attributes,
+        option=orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_SUBCLASS,
+    )
+
+
+_encode = encode_orjson if backend == "orjson" else encode_json
+
+
+def parse_fields(fields):
+    """Turns a comma separated ?fields= value into a set, or None for all."""
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(",") if field.strip()}
+
+
+def select(content, fields=None):
+    """Only the given top-level attributes of a chart (or keys of a dict),
+    or content itself if fields is None."""
+    if fields is None:
+        return content
+    content = public_attributes(content) if not isinstance(content, dict) else content
+    return {k: v for k, v in content.items() if k in fields}
+
+
+def dumps(content, fields=None):
+    """JSON bytes for content. If fields is given, only those top-level
+    attributes of a chart (or keys of a dict) are encoded at all."""
+    return _encode(select(content, fields))
+
+
+def plain(o):
+    """o as the dicts, lists and scalars the JSON encoder writes for it, with
+    non-string dict keys (object indexes and so on) turned into strings the
+    same way."""
+    if isinstance(o, (str, int, float, bool)) or o is None:
+        return o
+    if isinstance(o, dict):
+        return {
+            k if isinstance(k, str) else json.dumps(k): plain(v) for k, v in o.items()
+        }
+    if isinstance(o, (list, tuple)):
+        return [plain(v) for v in o]
+    return plain(public_attributes(o))
+
+
+def packb(content, fields=None):
+    """MessagePack bytes of the same document dumps() encodes."""
+    return msgpack.packb(plain(select(content, fields)))
+
+
+def encode(content, fields=None, media_type="application/json"):
+    if media_type == "application/msgpack":
+        return packb(content, fields)
+    return dumps(content, fields)
+
+
+def chart_response(chart, fields=None, media_type="application/json"):
+    return Response(
+        content=encode(chart, parse_fields(fields), media_type),
+        media_type=media_type,
+        headers={"Vary": "Accept"},
+    )
@@ -0,0 +1,72 @@
+"""
+Request coalescing. While a computation for a key is in flight, callers
+asking for the same key wait for it and get its result (or exception)
+instead of starting their own, so a burst of identical requests costs a
+single computation. Nothing is kept once the computation finishes; caching
+results is left to the caller.
+
+do() coalesces calls from threads (sync route handlers run in a thread
+pool), run() coalesces coroutines on one event loop.
+
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self.counters = {"leaders": 0, "followers": 0}
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _count(self, leader):
+        self.counters["leaders" if leader else "followers"] += 1
+
+    def do(self, key, fn, *args):
+        """fn(*args), shared with the threads calling do() with key while
+        it runs."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            self._count(leader)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def run(self, key, fn, *args):
+        """await fn(*args), shared with the coroutines calling run() with
+        key while it runs. A waiter being cancelled doesn't cancel the
+        computation the others are waiting for."""
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda done: self._finish(key, done))
+        with self._lock:
+            self._count(leader)
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["in_flight"] = len(self._calls) + len(self._tasks)
+        return stats
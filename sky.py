@@ -0,0 +1,89 @@
+"""
+Snapshot of the current sky: planet positions, moon phase and the planets
+currently retrograde. A background task started from the app's lifespan
+retakes it every SKY_REFRESH_INTERVAL seconds and swaps it in with a
+single assignment, so readers never lock and never see a half-built
+snapshot. The serialized body and its ETag are computed once per snapshot.
+
+"""
+
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from immanuel.const import calc, chart, names
+from immanuel.tools import date, ephemeris
+from events import sign_number
+import serializer
+
+refresh_interval = int(os.getenv("SKY_REFRESH_INTERVAL", 60))
+
+bodies = [
+    chart.SUN,
+    chart.MOON,
+    chart.MERCURY,
+    chart.VENUS,
+    chart.MARS,
+    chart.JUPITER,
+    chart.SATURN,
+    chart.URANUS,
+    chart.NEPTUNE,
+    chart.PLUTO,
+]
+
+_snapshot = None
+
+
+class Snapshot:
+    def __init__(self, moment):
+        self.moment = moment
+        jd = date.to_jd(moment)
+
+        planets, retrograde = {}, []
+        for index in bodies:
+            planet = ephemeris.get_planet(index, jd)
+            movement = ephemeris.object_movement(planet)
+            if movement == calc.RETROGRADE:
+                retrograde.append(planet["name"])
+            planets[planet["name"]] = {
+                "longitude": planet["lon"],
+                "latitude": planet["lat"],
+                "speed": planet["speed"],
+                "sign": names.SIGNS[sign_number(planet["lon"])],
+                "sign_longitude": planet["lon"] % 30,
+                "movement": names.OBJECT_MOVEMENTS[movement],
+            }
+
+        self.data = {
+            "date_time": moment.isoformat(),
+            "moon_phase": names.MOON_PHASES[ephemeris.moon_phase(jd)],
+            "planets": planets,
+            "retrograde": retrograde,
+        }
+        self.body = serializer.dumps({"success": 1, "data": self.data})
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def age(self, now=None):
+        return (now or datetime.now(timezone.utc)) - self.moment
+
+
+def take():
+    global _snapshot
+    moment = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    _snapshot = Snapshot(moment)
+    return _snapshot
+
+
+def current():
+    """The latest snapshot. Taken on the spot if the background task isn't
+    running or has fallen more than two intervals behind."""
+    snapshot = _snapshot
+    if snapshot is None or snapshot.age() > timedelta(seconds=2 * refresh_interval):
+        snapshot = take()
+    return snapshot
+
+
+async def refresh_forever():
+    while True:
+        await asyncio.to_thread(take)
+        await asyncio.sleep(refresh_interval)
@@ -0,0 +1,161 @@
+import asyncio
+import gc
+
+import pytest
+
+from admission import Admission, Rejected, client_address, cost
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_over_time():
+    clock = Clock()
+    admission = Admission(rate=2, burst=4, budget=100, clock=clock)
+    for _ in range(4):
+        admission.release(admission.admit("a", 1))
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("a", 3)
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 2
+    # Other clients have their own bucket
+    admission.release(admission.admit("b", 4))
+
+    clock.now = 1.5
+    admission.release(admission.admit("a", 3))
+    assert admission.stats()["over_quota"] == 1
+
+
+def test_made_up_tokens_share_their_address_bucket():
+    admission = Admission(tokens_per_address=2)
+    assert admission.client("a", "10.0.0.1") == "token:a"
+    assert admission.client("b", "10.0.0.1") == "token:b"
+    assert admission.client("c", "10.0.0.1") == "address:10.0.0.1"
+    assert admission.client("a", "10.0.0.1") == "token:a"
+    assert admission.client("c", "10.0.0.2") == "token:c"
+    assert admission.client(None, "10.0.0.2") == "address:10.0.0.2"
+
+    admission = Admission(tokens={"known"})
+    assert admission.client("known", "10.0.0.1") == "token:known"
+    assert admission.client("unknown", "10.0.0.1") == "address:10.0.0.1"
+
+
+def test_client_address_behind_proxies():
+    forwarded = "6.6.6.6, 203.0.113.7, 10.1.2.3"
+    assert client_address(forwarded, "10.0.0.1", 0) == "10.0.0.1"
+    # Cloud Run's front end appends the client's address
+    assert client_address("6.6.6.6, 203.0.113.7", "10.0.0.1", 1) == "203.0.113.7"
+    assert client_address(forwarded, "10.0.0.1", 2) == "203.0.113.7"
+    assert client_address(None, "10.0.0.1", 1) == "10.0.0.1"
+    assert client_address("203.0.113.7", "10.0.0.1", 2) == "10.0.0.1"
+
+
+def test_requests_bigger_than_the_bucket_need_a_full_one():
+    admission = Admission(rate=1, burst=10, budget=100, clock=Clock())
+    admission.release(admission.admit("a", 50))
+    with pytest.raises(Rejected):
+        admission.admit("a", 1)
+
+
+def test_budget_sheds_load_when_saturated():
+    admission = Admission(rate=100, burst=100, budget=10, clock=Clock())
+    first = admission.admit("a", 8)
+    with pytest.raises(Rejected) as rejected:
+        admission.admit("b", 4)
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after == 1
+    admission.release(first)
+    # An idle server admits a request over the budget
+    admission.release(admission.admit("b", 40))
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_long_streams_dont_starve_other_clients():
+    admission = Admission(rate=1, burst=200, budget=64, clock=Clock())
+
+    async def body():
+        for _ in range(3):
+            yield b"row"
+
+    async def main():
+        # A century of positions, charged the whole bucket
+        stream = admission.holding(body(), admission.admit("a", 200))
+        assert await anext(stream) == b"row"
+        assert admission.stats()["in_flight"] == 16
+        for client in "bcd":
+            admission.release(admission.admit(client, 1))
+        # Batches from other clients still fit alongside it
+        admission.release(admission.charge("e", admission.admit("e", 1), 64))
+        assert [chunk async for chunk in stream] == [b"row", b"row"]
+        assert admission.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+    assert admission.stats()["saturated"] == 0
+
+
+def test_charge_reserves_the_rest_of_the_cost():
+    admission = Admission(rate=1, burst=10, budget=100, clock=Clock())
+    held = admission.admit("a", 1)
+    assert admission.charge("a", held, 0.5) == 1
+    held = admission.charge("a", held, 6)
+    assert held == 6
+    assert admission.stats()["in_flight"] == 6
+    other = admission.admit("a", 3)
+    # Capped at the bucket size, but only one unit is left
+    with pytest.raises(Rejected) as rejected:
+        admission.charge("a", other, 20)
+    assert rejected.value.status_code == 429
+    admission.release(held)
+    admission.release(other)
+    assert admission.stats() == {
+        "admitted": 2,
+        "over_quota": 1,
+        "saturated": 0,
+        "in_flight": 0,
+    }
+
+
+def test_streamed_responses_hold_their_cost():
+    admission = Admission(rate=100, burst=100, budget=100, clock=Clock())
+
+    async def body():
+        yield b"a"
+        yield b"b"
+
+    async def main():
+        stream = admission.holding(body(), admission.admit("a", 5))
+        assert await anext(stream) == b"a"
+        assert admission.stats()["in_flight"] == 5
+        assert [chunk async for chunk in stream] == [b"b"]
+        assert admission.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+    # Dropped without being sent
+    stream = admission.holding(body(), admission.admit("a", 5))
+    assert admission.stats()["in_flight"] == 5
+    del stream
+    gc.collect()
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_costs_follow_parameters():
+    assert cost("/natal.json", {}, {}) == 1
+    assert cost("/retrograde_calendar", {"n": "120"}, {}) == 10
+    assert cost("/retrograde_calendar", {"n": "oops"}, {}) == 1
+    assert cost("/get_yearly_forecast_data", {"years": "2"}, {}) == 20
+    assert cost(
+        "/ephemeris_table",
+        {"start_date": "2000-01-01", "end_date": "2009-12-31", "step": "0.5"},
+        {},
+    ) == pytest.approx(7.306)
+    assert cost("/solar_returns", {"solar_return_year": "2020"}, {}) == 1
+    assert (
+        cost("/solar_returns", {"solar_return_year": "2020", "end_year": "2029"}, {})
+        == 10
+    )
@@ -1,6 +1,16 @@
+import json
+import msgpack
+import pyarrow
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from fastapi.testclient import TestClient
+from immanuel import charts
+from immanuel.classes.serialize import ToJSON
 
-from app import app
+import profiling
+import serializer
+import workers
+from app import admission_control, app
 
 client = TestClient(app)
 
@@ -26,6 +36,10 @@ def test_retrograde_calendar():
     assert response_json["data"][0]["planet"] == "Mercury"
     assert len(response_json["data"][0]["periods"]) >= 6
 
+    for n in (0, -3):
+        response = client.get(f"/retrograde_calendar?n={n}&lat=55.3948&lon=43.8399")
+        assert response.status_code == 422
+
 
 def test_get_daily_forecast_data():
     response = client.get(
@@ -69,3 +83,491 @@ def test_get_yearly_forecast_data():
     assert len(response_json["data"]["Mercury"]) == 3
     assert "sign" in response_json["data"]["Mercury"]
     assert "movement" in response_json["data"]["Mercury"]
+
+
+def test_concurrent_mixed_requests():
+    urls = [
+        "/natal.txt?year=1990&month=9&day=5&lat=55.3948&lon=43.8399&hour=15",
+        "/planetary_positions?year=1990&month=9&day=5&lat=55.3948&lon=43.8399&hour=15",
+        "/get_daily_forecast_data?start_date=2024-03-19",
+        "/get_weekly_forecast_data?start_date=2024-03-19",
+    ]
+
+    def fetch(url):
+        response = client.get(url, headers={"X-Token": "coneofsilence"})
+        assert response.status_code == 200
+        return response.content
+
+    sequential = [fetch(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        concurrent = list(executor.map(fetch, urls * 4))
+    assert concurrent == sequential * 4
+    # The forecasts' planets-only object list must not leak into natal charts
+    assert b"Sun" in sequential[0]
+
+
+def test_cached_chart_responses():
+    url = "/natal.json?year=1985&month=1&day=2&lat=51.5&lon=-0.1&hour=6"
+    before = client.get("/cache/stats").json()["data"]
+    first = client.get(url, headers={"X-Token": "coneofsilence"})
+    second = client.get(url, headers={"X-Token": "another token"})
+    after = client.get("/cache/stats").json()["data"]
+    assert first.status_code == 200
+    assert first.content == second.content
+    assert "objects" in first.json()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    text = client.get(url.replace("natal.json", "natal.txt"))
+    assert text.headers["content-type"].startswith("text/plain")
+    assert text.text.strip().startswith("Daytime:")
+
+
+def test_natal_json_matches_immanuel_serializer():
+    response = client.get(
+        "/natal.json?year=1990&month=9&day=5&lat=55.3948&lon=43.8399&hour=15"
+    )
+    native = charts.Subject(datetime(1990, 9, 5, 15, 0, 0), 55.3948, 43.8399)
+    expected = json.dumps(
+        charts.Natal(native), cls=ToJSON, ensure_ascii=False, separators=(",", ":")
+    )
+    assert response.content == expected.encode("utf-8")
+    if serializer.orjson is not None:
+        assert json.loads(serializer.encode_orjson(charts.Natal(native))) == (
+            json.loads(expected)
+        )
+
+
+def test_natal_json_fields():
+    response = client.get(
+        "/natal.json?year=1990&month=9&day=5&lat=55.3948&lon=43.8399&hour=15"
+        "&fields=objects,aspects"
+    )
+    assert response.status_code == 200
+    assert list(response.json().keys()) == ["objects", "aspects"]
+
+
+def test_chart_endpoints():
+    subject = "year=1990&month=9&day=5&hour=15&lat=55.3948&lon=43.8399"
+    partner = "year2=1992&month2=3&day2=1&hour2=8&lat2=51.5&lon2=-0.1"
+    for url in (
+        f"/transits?{subject}",
+        f"/progressions?{subject}",
+        f"/synastry?{subject}&{partner}",
+        f"/composite?{subject}&{partner}",
+        f"/solar_returns?{subject}&solar_return_year=2024",
+    ):
+        response = client.post(url + "&fields=type,objects")
+        assert response.status_code == 200, url
+        assert response.json().keys() == {"type", "objects"}
+
+
+def test_natal_batch():
+    subjects = [
+        {"id": 1, "year": 1990, "month": 9, "day": 5, "lat": 55.3948, "lon": 43.8399},
+        {"id": "b", "year": 1992, "month": 2, "day": 30, "lat": 51.5, "lon": -0.1},
+        {
+            "id": "c",
+            "year": 1985,
+            "month": 1,
+            "day": 2,
+            "hour": 6,
+            "lat": 51.5,
+            "lon": -0.1,
+        },
+    ]
+    response = client.post(
+        "/natal/batch", json={"subjects": subjects, "fields": "objects"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = {line["id"]: line for line in map(json.loads, response.text.splitlines())}
+    assert lines.keys() == {1, "b", "c"}
+    assert lines[1]["success"] == 1 and lines["c"]["success"] == 1
+    assert lines[1]["data"].keys() == {"objects"}
+    assert lines["b"]["success"] == 0
+    assert "day is out of range" in lines["b"]["error"]
+
+
+def test_natal_batch_goes_through_workers(monkeypatch):
+    subjects = [
+        {"id": i, "year": 1990, "month": 9, "day": 5, "lat": 55.4, "lon": 43.8}
+        for i in range(3)
+    ]
+    monkeypatch.setattr(workers, "max_queue", 0)
+    response = client.post("/natal/batch", json={"subjects": subjects})
+    assert response.status_code == 503
+
+    monkeypatch.setattr(workers, "max_queue", 8)
+    monkeypatch.setattr(workers, "backend", "thread")
+    monkeypatch.setattr(workers, "_pool", None)
+    monkeypatch.setattr(workers, "get_pool", None)
+    response = client.post("/natal/batch", json={"subjects": subjects})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["success"] for line in lines] == [1, 1, 1]
+
+
+def test_worker_limits(monkeypatch):
+    url = "/natal.json?year=1977&month=7&day=7&lat=40.7&lon=-74.0&hour=7"
+    monkeypatch.setattr(workers, "max_queue", 0)
+    response = client.get(url)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+    monkeypatch.setattr(workers, "max_queue", 8)
+    monkeypatch.setattr(workers, "task_timeout", 1e-6)
+    assert client.get(url).status_code == 504
+
+    monkeypatch.setattr(workers, "task_timeout", 30)
+    assert client.get(url).status_code == 200
+
+
+def test_ephemeris_table():
+    response = client.get(
+        "/ephemeris_table?start_date=2024-03-19&end_date=2024-03-21&step=0.5"
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["date"][0] == "2024-03-19T00:00:00"
+    assert data["date"][-1] == "2024-03-21T00:00:00"
+    assert len(data["planets"]["Mercury"]["longitude"]) == 5
+    assert data["planets"]["Mercury"]["sign"][0] == "Aries"
+
+    response = client.get("/ephemeris_table?start_date=2024-03-19&end_date=2024-03-01")
+    assert response.status_code == 400
+
+
+def test_planetary_positions_range(monkeypatch):
+    url = "/planetary_positions/range?start=2024-03-19&end=2024-03-20T12:00&step=0.5"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 4 * 8
+    assert rows[0]["date"] == "2024-03-19T00:00:00"
+    assert rows[-1]["date"] == "2024-03-20T12:00:00"
+    assert rows[0]["planet"] == "Mercury" and rows[0]["sign"] == "Aries"
+
+    response = client.get(url + "&format=csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "date,planet,longitude,latitude,speed,sign,movement"
+    assert len(lines) == 1 + 4 * 8
+
+    monkeypatch.setattr("app.positions_range_max_samples", 3)
+    response = client.get(url)
+    assert response.status_code == 400
+    assert "samples per request" in response.json()["error"]
+
+
+def test_msgpack_responses():
+    url = "/natal.json?year=1990&month=9&day=5&lat=55.3948&lon=43.8399&hour=15"
+    packed = client.get(url, headers={"Accept": "application/msgpack"})
+    assert packed.status_code == 200
+    assert packed.headers["content-type"] == "application/msgpack"
+    assert packed.headers["vary"] == "Accept"
+    assert len(packed.content) < len(client.get(url).content)
+    chart = msgpack.unpackb(packed.content, strict_map_key=False)
+    assert chart["objects"]["4000001"]["sign"]["name"] == "Virgo"
+
+    # Cached separately from the JSON response
+    assert client.get(url).headers["content-type"] == "application/json"
+
+    packed = client.get(
+        "/get_yearly_forecast_data?start_date=2024-04-01",
+        headers={"Accept": "application/msgpack"},
+    )
+    assert msgpack.unpackb(packed.content)["data"]["Mercury"]["sign"]
+
+
+def test_arrow_responses():
+    headers = {"Accept": "application/vnd.apache.arrow.stream"}
+    response = client.get(
+        "/get_yearly_forecast_data?start_date=2024-04-01", headers=headers
+    )
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["planet", "kind", "start", "end", "value"]
+    assert table.schema.field("start").type == pyarrow.date32()
+
+    response = client.get(
+        "/ephemeris_table?start_date=2024-03-19&end_date=2024-03-20&step=0.5",
+        headers=headers,
+    )
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 3 * 8
+    assert table.schema.field("longitude").type == pyarrow.float64()
+
+    response = client.get(
+        "/retrograde_calendar?n=12&lat=55.3948&lon=43.8399", headers=headers
+    )
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["planet", "start", "end"]
+
+    url = "/planetary_positions/range?start=2024-03-19&end=2024-03-20T12:00&step=0.5"
+    for response in (
+        client.get(url, headers=headers),
+        client.get(url + "&format=arrow"),
+    ):
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        assert table.num_rows == 4 * 8
+        assert table.column("planet")[0].as_py() == "Mercury"
+        assert table.schema.field("date").type == pyarrow.timestamp("us")
+
+
+def test_server_timing_and_metrics(monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    profiling.install()
+    response = client.get(
+        "/natal.json?year=1969&month=7&day=20&lat=28.6&lon=-80.6&hour=20"
+    )
+    timing = response.headers["server-timing"]
+    for name in ("total;dur=", "chart;dur=", "serialize;dur=", "ephemeris_calls;desc="):
+        assert name in timing
+
+    metrics = client.get("/metrics").text
+    assert 'api_requests_total{route="/natal.json",code="200"}' in metrics
+    assert 'api_ephemeris_calls_total{route="/natal.json"}' in metrics
+    assert 'api_request_duration_seconds_count{route="/natal.json"}' in metrics
+
+    url = "/natal.txt?year=1969&month=7&day=20&lat=28.6&lon=-80.6&hour=20&profile=1"
+    # Profiling is off unless PROFILE_REQUESTS allows it
+    assert client.get(url).text.strip().startswith("Daytime:")
+    monkeypatch.setattr(profiling, "allow_profile", True)
+    report = client.get(url.replace("hour=20", "hour=21")).text
+    assert "cumulative" in report
+    assert "natal_text" in report
+
+
+def test_sky_now():
+    response = client.get("/sky/now")
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert set(data["planets"]) >= {"Sun", "Moon", "Mercury", "Pluto"}
+    assert all(
+        data["planets"][name]["movement"] == "Retrograde" for name in data["retrograde"]
+    )
+    assert data["moon_phase"]
+
+    etag = response.headers["etag"]
+    cached = client.get("/sky/now", headers={"If-None-Match": f'"other", W/{etag}'})
+    if cached.status_code == 200:
+        # The snapshot was retaken in between
+        assert cached.headers["etag"] != etag
+    else:
+        assert cached.status_code == 304
+        assert cached.content == b""
+
+
+def test_conditional_get(monkeypatch):
+    url = "/get_daily_forecast_data?start_date=2024-03-20"
+    response = client.get(url)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    assert client.get(url, headers={"X-Token": "other"}).headers["etag"] == etag
+    assert client.get(url[:-1] + "1").headers["etag"] != etag
+    # X-Token doesn't change the result, Accept may
+    accept = {"Accept": "application/msgpack"}
+    assert client.get(url, headers=accept).headers["etag"] != etag
+
+    def compute(*args):
+        raise AssertionError("computed despite a matching If-None-Match")
+
+    monkeypatch.setattr("app.daily_forecast_data", compute)
+    cached = client.get(url, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    retrograde = client.get("/retrograde_calendar?n=1&lat=55.3948&lon=43.8399")
+    assert retrograde.headers["cache-control"] == "public, max-age=60"
+    assert "etag" not in client.get("/natal.json?year=1990").headers
+
+
+def test_get_yearly_forecast_data_years():
+    response = client.get("/get_yearly_forecast_data?start_date=2024-03-19&years=3")
+    assert response.status_code == 200
+    mercury = response.json()["data"]["Mercury"]
+    assert mercury["sign"][0]["period"].startswith("2024-03-19")
+    assert mercury["sign"][-1]["period"].endswith("2027-03-19")
+    assert (
+        client.get(
+            "/get_yearly_forecast_data?start_date=2024-03-19&years=0"
+        ).status_code
+        == 422
+    )
+
+
+def test_synastry_matrix():
+    subjects = [
+        {
+            "id": "a",
+            "year": 1990,
+            "month": 9,
+            "day": 5,
+            "hour": 15,
+            "lat": 55.4,
+            "lon": 43.8,
+        },
+        {"id": "b", "year": 1985, "month": 1, "day": 2, "lat": 51.5, "lon": -0.1},
+    ]
+    response = client.post("/synastry/matrix", json={"subjects": subjects})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["rows"] == data["columns"] == ["a", "b"]
+    assert data["aspects"][0][1] == data["aspects"][1][0] > 0
+    assert len(data["score"]) == 2 and len(data["score"][0]) == 2
+
+    response = client.post(
+        "/synastry/matrix",
+        json={"subjects": subjects[:1], "others": [dict(subjects[1], day=31, month=2)]},
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/synastry/matrix", json={"subjects": subjects, "others": []}
+    )
+    assert response.status_code == 422
+
+
+def test_moon_calendar():
+    response = client.get("/moon_calendar?start_date=2024-01-01&days=31")
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [p["phase"] for p in data["phases"]] == [
+        "Third Quarter",
+        "New",
+        "First Quarter",
+        "Full",
+    ]
+    assert len(data["ingresses"]) >= 13
+    assert all(v["start"] < v["end"] for v in data["void_of_course"])
+    assert client.get("/moon_calendar?start_date=2024-01-01&days=0").status_code == 422
+
+
+def test_aspect_timeline():
+    response = client.get("/aspect_timeline?start_date=2024-01-20&days=14")
+    assert response.status_code == 200
+    data = response.json()["data"]
+    conjunction = [
+        a
+        for a in data
+        if {a["active"], a["passive"]} == {"Mercury", "Mars"} and a["aspect"] == 0
+    ]
+    assert conjunction[0]["exact"][0].startswith("2024-01-27")
+    assert all(a["type"] for a in data)
+
+
+def test_solar_returns_range():
+    subject = "year=1990&month=9&day=5&hour=15&lat=55.3948&lon=43.8399"
+    single = client.post(f"/solar_returns?{subject}&solar_return_year=2024").json()
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2022&end_year=2024"
+    )
+    assert response.status_code == 200
+    charts = response.json()
+    assert len(charts) == 3
+    assert charts[2] == single
+
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2022&end_year=2024&light=true"
+    )
+    moments = response.json()
+    assert [m["year"] for m in moments] == [2022, 2023, 2024]
+    sun_return = single["solar_return_date_time"]
+    assert abs(moments[2]["julian_date"] - sun_return["julian"]) < 1e-5
+    ascendant = single["objects"]["3000001"]["longitude"]["raw"]
+    assert abs(moments[2]["asc"]["longitude"] - ascendant) < 1e-3
+
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2024&end_year=2022"
+    )
+    assert response.status_code == 400
+    assert response.json()["success"] == 0
+
+
+def test_solar_returns_msgpack():
+    subject = "year=1990&month=9&day=5&hour=15&lat=55.3948&lon=43.8399"
+    accept = {"Accept": "application/msgpack"}
+    single = client.post(f"/solar_returns?{subject}&solar_return_year=2024").json()
+
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2024", headers=accept
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    chart = msgpack.unpackb(response.content)
+    assert chart["solar_return_date_time"] == single["solar_return_date_time"]
+
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2023&end_year=2024",
+        headers=accept,
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    charts = msgpack.unpackb(response.content)
+    assert len(charts) == 2
+    assert charts[1]["objects"].keys() == single["objects"].keys()
+
+    response = client.post(
+        f"/solar_returns?{subject}&solar_return_year=2023&end_year=2024&light=true",
+        headers=accept,
+    )
+    moments = msgpack.unpackb(response.content)
+    assert [m["year"] for m in moments] == [2023, 2024]
+
+
+def test_planetary_positions_objects():
+    url = "/planetary_positions?year=1990&month=9&day=5&lat=55.3948&lon=43.8399"
+    response = client.get(url + "&hour=15&objects=mars,Sun")
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [p["name"] for p in data] == ["Sun", "Mars"]
+    assert data[0]["house"] == "9th House"
+
+    data = client.get(url).json()["data"]
+    assert len(data) == 10
+    assert all(p["house"] == "" for p in data)
+
+    response = client.get(url + "&objects=Sun,Chiron")
+    assert response.status_code == 400
+    assert response.json()["success"] == 0
+
+    data = client.get(url + "&objects=Moon,Sun,sun, moon").json()["data"]
+    assert [p["name"] for p in data] == ["Sun", "Moon"]
+    for empty in (",", ""):
+        response = client.get(url + "&objects=" + empty)
+        assert response.status_code == 400
+        assert response.json()["error"] == "No objects given"
+
+
+def test_admission_quota(monkeypatch):
+    monkeypatch.setattr(admission_control, "burst", 3)
+    monkeypatch.setattr(admission_control, "rate", 0.01)
+    headers = {"X-Token": "admission-test"}
+    for _ in range(3):
+        response = client.get("/sky/now", headers=headers)
+        assert response.status_code == 200
+    response = client.get("/sky/now", headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    assert response.json()["success"] == 0
+    # Metrics stay reachable
+    assert client.get("/metrics", headers=headers).status_code == 200
+    assert 'api_admission_total{outcome="over_quota"}' in client.get("/metrics").text
+
+
+def test_admission_charges_parsed_bodies(monkeypatch):
+    monkeypatch.setattr(admission_control, "burst", 3)
+    monkeypatch.setattr(admission_control, "rate", 0.01)
+    subject = {"year": 1990, "month": 9, "day": 5, "lat": 55.3948, "lon": 43.8399}
+    body = json.dumps({"subjects": [dict(subject, id=i) for i in range(5)]})
+    headers = {"X-Token": "chunked-test"}
+    assert client.get("/sky/now", headers=headers).status_code == 200
+    # Chunked, so the body's size isn't known up front
+    response = client.post(
+        "/natal/batch",
+        content=iter([body.encode()]),
+        headers={**headers, "Content-Type": "application/json"},
+    )
+    assert "content-length" not in response.request.headers
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
@@ -0,0 +1,54 @@
+from caching import LRUCache, MemoryBackend, ResponseCache, cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.get("a")
+    cache.set("c", b"3")
+    assert cache.get("a") == b"1"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"3"
+
+
+def test_lru_expires_entries():
+    clock = Clock()
+    cache = LRUCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("a", b"1")
+    clock.now = 59
+    assert cache.get("a") == b"1"
+    clock.now = 60
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_shared_backend_is_used_across_instances():
+    clock = Clock()
+    shared = MemoryBackend(clock=clock)
+    first = ResponseCache(LRUCache(), shared=shared, ttl=60)
+    second = ResponseCache(LRUCache(), shared=shared, ttl=60)
+
+    first.set("key", b"body")
+    assert second.get("key") == b"body"
+    assert second.get("key") == b"body"
+    assert second.stats() == {"hits": 1, "shared_hits": 1, "misses": 0, "size": 1}
+
+    clock.now = 61
+    assert ResponseCache(LRUCache(), shared=shared).get("key") is None
+
+
+def test_cache_key_is_normalized():
+    assert cache_key("natal", {"lat": 1.0, "lon": 2.0}) == cache_key(
+        "natal", {"lon": 2.0, "lat": 1.0}
+    )
+    assert cache_key("natal", {"lat": 1.0}) != cache_key("natal", {"lat": 1.5})
+    assert cache_key("natal", {"lat": 1.0}) != cache_key("synastry", {"lat": 1.0})
@@ -0,0 +1,42 @@
+from datetime import date
+
+from formats import ARROW, JSON, MSGPACK, accepted, negotiate, period_rows
+
+
+def test_accepted_qualities():
+    assert accepted("application/x-msgpack;q=0.5, application/json") == {
+        MSGPACK: 0.5,
+        JSON: 1.0,
+    }
+    assert accepted("text/*;q=bad") == {"text/*": 0.0}
+    assert accepted(None) == {}
+
+
+def test_negotiate():
+    offered = (JSON, MSGPACK, ARROW)
+    assert negotiate(None, offered) == JSON
+    assert negotiate("*/*", offered) == JSON
+    assert negotiate("text/html", offered) == JSON
+    assert negotiate("application/msgpack", offered) == MSGPACK
+    assert negotiate("application/json;q=0.9, application/msgpack", offered) == MSGPACK
+    assert negotiate("application/msgpack;q=0.1, application/*", offered) == JSON
+    # Arrow isn't offered for documents
+    assert negotiate(ARROW, (JSON, MSGPACK)) == JSON
+
+
+def test_period_rows():
+    periods = {
+        "Mars": {
+            "sign": [
+                {"period": "2024-01-01 - 2024-02-12", "value": "Capricorn"},
+                {"period": "2024-02-13 - 2024-03-22", "value": "Aquarius"},
+            ]
+        }
+    }
+    assert period_rows(periods)[1] == {
+        "planet": "Mars",
+        "kind": "sign",
+        "start": date(2024, 2, 13),
+        "end": date(2024, 3, 22),
+        "value": "Aquarius",
+    }
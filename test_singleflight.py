@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from forecast_store import ForecastStore
+from singleflight import SingleFlight
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def compute(x):
+        calls.append(x)
+        started.set()
+        time.sleep(0.2)
+        return x * 2
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(flights.do("k", compute, 21))
+    )
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("k", compute, 21)))
+        for _ in range(8)
+    ]
+    for thread in followers:
+        thread.start()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert calls == [21]
+    assert results == [42] * 9
+    assert flights.stats() == {"leaders": 1, "followers": 8, "in_flight": 0}
+    # Finished calls are not remembered
+    assert flights.do("k", compute, 1) == 2
+
+
+def test_threads_share_exceptions():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("k", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_coroutines_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute(x):
+        calls.append(x)
+        await asyncio.sleep(0.05)
+        return x * 2
+
+    async def main():
+        waiters = [
+            asyncio.create_task(flights.run("k", compute, 21)) for _ in range(10)
+        ]
+        await asyncio.sleep(0.01)
+        # A cancelled waiter leaves the others' computation running
+        waiters[0].cancel()
+        results = await asyncio.gather(*waiters[1:])
+        with pytest.raises(asyncio.CancelledError):
+            await waiters[0]
+        return results
+
+    assert asyncio.run(main()) == [42] * 9
+    assert calls == [21]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_forecast_store_computes_a_day_once():
+    calls = []
+
+    def compute(date_time):
+        calls.append(date_time)
+        time.sleep(0.1)
+        return {"day": date_time.isoformat()}
+
+    store = ForecastStore(compute)
+    day = datetime(2024, 3, 19)
+    threads = [threading.Thread(target=store.get, args=(day,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [day]
+    assert store.get(day) == {"day": "2024-03-19T00:00:00"}
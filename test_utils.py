@@ -0,0 +1,446 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from immanuel import charts
+from immanuel.const import chart, calc, names
+from immanuel.tools import date, ephemeris
+
+import aspect_events
+import compatibility
+import ephemeris_index
+import moon
+from ephemeris_index import EphemerisIndex
+from events import planet_position
+from forecast_store import ForecastStore
+from positions import PositionTable
+import serializer
+import transits
+import workers
+from utils import (
+    chart_settings,
+    day_forecast,
+    forecast_settings,
+    indexed_yearly_forecast_data,
+    planets,
+    retrograde_periods,
+    yearly_forecast_data,
+)
+
+
+def scan_retrograde_periods(n, lat, lon, start_date):
+    """The original brute-force scanner, sampling every planet every 30
+    minutes, unchanged but for taking start_date instead of now. Kept as
+    the reference for the station solver."""
+    retro_table = {obj: [] for obj in planets}
+
+    coords = [lat, lon]
+
+    now = start_date
+    end_date = now + timedelta(days=n * 30)
+
+    start_day = datetime(now.year, now.month, now.day, 0, 0, 0, 0, None)
+    end_day = datetime(end_date.year, end_date.month, end_date.day, 0, 0, 0, 0, None)
+
+    buffer = {
+        obj: {
+            "start": None,
+            "end": None,
+            "current_direction": calc.DIRECT,
+        }
+        for obj in planets
+    }
+
+    current_day = start_day
+    while current_day < end_day:
+        day_jd = date.to_jd(current_day)
+        objects = ephemeris.get_objects(
+            tuple(planets),
+            day_jd,
+            *coords,
+            chart.PLACIDUS,
+            calc.DAY_NIGHT_FORMULA,
+        ).values()
+        for obj in list(objects):
+            movement = ephemeris.object_movement(obj)
+            if (
+                movement == calc.RETROGRADE
+                and buffer[obj["index"]]["current_direction"] == calc.DIRECT
+            ):
+                buffer[obj["index"]]["start"] = current_day
+                buffer[obj["index"]]["current_direction"] = calc.RETROGRADE
+            elif (
+                movement == calc.DIRECT
+                and buffer[obj["index"]]["current_direction"] == calc.RETROGRADE
+            ):
+                buffer[obj["index"]]["end"] = current_day
+                buffer[obj["index"]]["current_direction"] = calc.DIRECT
+                retro_table[obj["index"]].append(
+                    (buffer[obj["index"]]["start"], buffer[obj["index"]]["end"])
+                )
+        current_day = current_day + timedelta(minutes=30)
+
+    for obj in buffer:
+        if (
+            buffer[obj]["current_direction"] == calc.RETROGRADE
+            and buffer[obj]["start"] != None
+            and buffer[obj]["end"] == None
+        ):
+            retro_table[obj].append((buffer[obj]["start"], end_day))
+
+    return retro_table
+
+
+def test_retrograde_periods_match_scanner():
+    start_date = datetime(2024, 3, 19)
+    scanned = scan_retrograde_periods(12, 55.3948, 43.8399, start_date)
+    solved = retrograde_periods(12, 55.3948, 43.8399, start_date)
+
+    assert scanned.keys() == solved.keys()
+    for obj in planets:
+        assert len(scanned[obj]) == len(solved[obj])
+        for scanned_period, solved_period in zip(scanned[obj], solved[obj]):
+            for scanned_time, solved_time in zip(scanned_period, solved_period):
+                # The scanner reports the first half-hour tick after a station
+                assert (
+                    timedelta(0) <= scanned_time - solved_time <= timedelta(minutes=30)
+                )
+
+
+def test_retrograde_periods_keep_trailing_period():
+    # Mercury stations retrograde on 2024-11-26 and is still retrograde
+    # when the calendar ends. The original scanner only reported an open
+    # trailing period for planets with no completed one, so it dropped
+    # this one; the solver reports it.
+    start_date = datetime(2024, 3, 19)
+    scanned = scan_retrograde_periods(9, 0.0, 0.0, start_date)
+    solved = retrograde_periods(9, 0.0, 0.0, start_date)
+
+    mercury = solved[chart.MERCURY]
+    assert len(mercury) == len(scanned[chart.MERCURY]) + 1 == 3
+    start, end = mercury[-1]
+    assert start.date().isoformat() == "2024-11-26"
+    assert end == datetime(2024, 12, 14)
+
+
+def test_retrograde_periods_exact_stations():
+    periods = retrograde_periods(2, 0.0, 0.0, datetime(2024, 3, 19))
+    start, end = periods[chart.MERCURY][0]
+    for moment, before, after in (
+        (start, calc.STATIONARY, calc.RETROGRADE),
+        (end, calc.STATIONARY, calc.DIRECT),
+    ):
+        jd = date.to_jd(moment)
+        second = 1 / 86400
+        assert (
+            ephemeris.object_movement(planet_position(chart.MERCURY, jd - second)[3])
+            == before
+        )
+        assert (
+            ephemeris.object_movement(planet_position(chart.MERCURY, jd + second)[3])
+            == after
+        )
+
+
+def chart_yearly_forecast_data(start_date):
+    """The original yearly forecast, casting a full Natal chart per day.
+    Kept as the reference for the raw-position engine."""
+    attributes = ["sign", "house", "movement"]
+    cursor = {}
+    planet_positions = {}
+
+    for i in range(365):
+        day = start_date + timedelta(days=i)
+        native = charts.Subject(date_time=day, latitude=0.0, longitude=0.0)
+        natal = charts.Natal(native, settings=forecast_settings)
+        for object in natal.objects.values():
+            positions = planet_positions.setdefault(
+                object.name, {key: [] for key in attributes}
+            )
+            for key in attributes:
+                attr = getattr(object, key)
+                value = attr.formatted if key == "movement" else attr.name
+                current = cursor.setdefault(object.name, {}).get(key)
+                if current is None:
+                    cursor[object.name][key] = {"value": value, "start": day}
+                elif current["value"] != value:
+                    end = day - timedelta(days=1)
+                    positions[key].append(
+                        {
+                            "period": f'{current["start"]:%Y-%m-%d} - {end:%Y-%m-%d}',
+                            "value": current["value"],
+                        }
+                    )
+                    cursor[object.name][key] = {"value": value, "start": day}
+
+    end = start_date + timedelta(days=365)
+    for name, keys in cursor.items():
+        for key, current in keys.items():
+            planet_positions[name][key].append(
+                {
+                    "period": f'{current["start"]:%Y-%m-%d} - {end:%Y-%m-%d}',
+                    "value": current["value"],
+                }
+            )
+
+    return planet_positions
+
+
+def test_yearly_forecast_matches_charts(monkeypatch):
+    monkeypatch.setattr(ephemeris_index, "current", lambda: None)
+    start_date = datetime(2024, 4, 1)
+    assert yearly_forecast_data(start_date) == chart_yearly_forecast_data(start_date)
+
+
+def test_ephemeris_index_round_trip(tmp_path):
+    index = EphemerisIndex.build(
+        date.to_jd(datetime(2024, 1, 1)), date.to_jd(datetime(2024, 3, 1))
+    )
+    path = tmp_path / "index.npz"
+    index.save(path)
+    loaded = EphemerisIndex.load(path)
+    assert (loaded.start_jd, loaded.end_jd) == (index.start_jd, index.end_jd)
+    assert loaded.arrays.keys() == index.arrays.keys()
+    for key, array in index.arrays.items():
+        assert (loaded.arrays[key] == array).all()
+
+
+def test_indexed_calendars_match_computed(monkeypatch):
+    index = EphemerisIndex.build(
+        date.to_jd(datetime(2024, 1, 1)), date.to_jd(datetime(2025, 7, 1))
+    )
+    start_date = datetime(2024, 4, 1)
+
+    monkeypatch.setattr(ephemeris_index, "current", lambda: None)
+    computed_yearly = yearly_forecast_data(start_date)
+    computed_retrogrades = retrograde_periods(12, 0.0, 0.0, start_date)
+
+    monkeypatch.setattr(ephemeris_index, "current", lambda: index)
+    assert yearly_forecast_data(start_date) == computed_yearly
+    indexed_retrogrades = retrograde_periods(12, 0.0, 0.0, start_date)
+    for obj in planets:
+        assert len(indexed_retrogrades[obj]) == len(computed_retrogrades[obj])
+        for indexed, computed in zip(
+            indexed_retrogrades[obj], computed_retrogrades[obj]
+        ):
+            assert abs(indexed[0] - computed[0]) < timedelta(seconds=1)
+            assert abs(indexed[1] - computed[1]) < timedelta(seconds=1)
+
+
+def test_forecast_store_memoizes_days(tmp_path):
+    computed = []
+
+    def compute(date_time):
+        computed.append(date_time)
+        return day_forecast(date_time)
+
+    path = tmp_path / "forecasts.sqlite"
+    store = ForecastStore(compute, maxsize=2, path=str(path))
+    day = datetime(2024, 3, 19)
+    assert store.get(day) == day_forecast(day)
+    store.prewarm(day.date(), 3)
+    assert computed == [day, day + timedelta(days=1), day + timedelta(days=2)]
+
+    # Evicted from memory but still on disk, and on disk for a new process
+    assert store.get(day) == day_forecast(day)
+    assert ForecastStore(compute, path=str(path)).get(day) == day_forecast(day)
+    assert len(computed) == 3
+
+    # Only midnights are memoized
+    store.get(day + timedelta(hours=12))
+    assert len(computed) == 4
+
+
+def test_position_table_matches_charts():
+    start = datetime(2024, 3, 19)
+    jds = date.to_jd(start) + np.arange(0, 3, 0.5)
+    table = PositionTable(jds, planets)
+    for column, jd in enumerate(jds.tolist()):
+        objects = ephemeris.get_objects(planets, jd)
+        for row, obj in enumerate(planets):
+            assert table.longitude[row, column] == objects[obj]["lon"]
+            assert table.speed[row, column] == objects[obj]["speed"]
+            assert table.sign[row, column] == int(objects[obj]["lon"] // 30) + 1
+            assert table.movement[row, column] == ephemeris.object_movement(
+                objects[obj]
+            )
+
+
+def test_transits_share_sky_and_natal():
+    moment = datetime(2024, 3, 19, 12, 30, tzinfo=timezone.utc)
+    natal = transits.natal_chart(datetime(1990, 9, 5, 15), 55.3948, 43.8399)
+    assert transits.natal_chart(datetime(1990, 9, 5, 15), 55.3948, 43.8399) is natal
+
+    transit = transits.transits_chart(natal, moment)
+    subject = transits.local_subject(moment, natal._native)
+    expected = charts.Natal(subject, aspects_to=natal)
+    assert transit.native.date_time.datetime == expected.native.date_time.datetime
+    for field in ("objects", "houses", "aspects", "moon_phase", "diurnal"):
+        assert serializer.dumps(getattr(transit, field)) == serializer.dumps(
+            getattr(expected, field)
+        )
+
+    # Another subject elsewhere in the same minute reuses the sky
+    transits.skies.clear()
+    other = transits.natal_chart(datetime(1985, 1, 2, 6), 51.5, -0.1)
+    transits.transits_chart(other, moment)
+    transits.transits_chart(natal, moment)
+    assert len(transits.skies) == 1
+
+
+def test_timeline_blocks_join_seamlessly(monkeypatch):
+    monkeypatch.setattr(ephemeris_index, "current", lambda: None)
+    # Block 24 starts on 2024-01-19, so this window spans two blocks
+    start_date = datetime(2023, 6, 1)
+    start_jd = date.to_jd(start_date)
+    assert ephemeris_index.block(24).start_jd == ephemeris_index.epoch_jd + 24 * 366
+    built = EphemerisIndex.build(start_jd, start_jd + 364)
+    assert yearly_forecast_data(start_date) == indexed_yearly_forecast_data(
+        built, start_date
+    )
+
+    two_years = yearly_forecast_data(start_date, years=2)
+    assert two_years["Pluto"]["sign"][-1]["period"].endswith("2025-05-31")
+
+
+def test_aspect_matrix_matches_synastry_charts():
+    subjects = [
+        {
+            "id": 1,
+            "year": 1990,
+            "month": 9,
+            "day": 5,
+            "hour": 15,
+            "lat": 55.4,
+            "lon": 43.8,
+        },
+        {
+            "id": 2,
+            "year": 1985,
+            "month": 1,
+            "day": 2,
+            "hour": 6,
+            "lat": 51.5,
+            "lon": -0.1,
+        },
+        {
+            "id": 3,
+            "year": 2001,
+            "month": 7,
+            "day": 19,
+            "hour": 22,
+            "lat": -33.9,
+            "lon": 151.2,
+        },
+    ]
+    data = compatibility.matrix_data(subjects[:1], subjects)
+    settings = chart_settings(objects=compatibility.bodies)
+
+    def chart(s):
+        subject = charts.Subject(
+            datetime(s["year"], s["month"], s["day"], s["hour"]), s["lat"], s["lon"]
+        )
+        return charts.Natal(subject, settings=settings)
+
+    for column, other in enumerate(subjects):
+        synastry = charts.Natal(
+            chart(subjects[0])._native, aspects_to=chart(other), settings=settings
+        )
+        count = sum(len(aspects) for aspects in synastry.aspects.values())
+        assert data["aspects"][0][column] == count
+    assert data["rows"] == [1] and data["columns"] == [1, 2, 3]
+
+    empty = compatibility.matrix_data(subjects, [])
+    assert empty["columns"] == [] and empty["aspects"] == [[], [], []]
+
+
+def test_moon_events_are_exact():
+    start, end = datetime(2023, 12, 15), datetime(2024, 1, 15)
+    events = moon.MoonEvents(date.to_jd(start), date.to_jd(end))
+
+    assert [phase for _, phase in events.phases] == [
+        calc.FIRST_QUARTER,
+        calc.FULL_MOON,
+        calc.THIRD_QUARTER,
+        calc.NEW_MOON,
+    ]
+    for jd, phase in events.phases:
+        sun = ephemeris.get_planet(chart.SUN, jd)["lon"]
+        lunar = ephemeris.get_planet(chart.MOON, jd)["lon"]
+        angle = [a for a, p in moon.phases.items() if p == phase][0]
+        assert abs(swe_difference(lunar - sun, angle)) < 1e-4
+    for jd, sign in events.ingresses:
+        lunar = ephemeris.get_planet(chart.MOON, jd)["lon"]
+        assert abs(swe_difference(lunar, (sign - 1) * 30)) < 1e-4
+
+    ingress_jds = [jd for jd, _ in events.ingresses]
+    for void_start, void_end, sign, body, aspect in events.void_of_course:
+        assert void_end in ingress_jds
+        assert void_end - 3 < void_start < void_end
+        lunar = ephemeris.get_planet(chart.MOON, void_start)["lon"]
+        assert int(lunar // 30) + 1 == sign
+
+    # Years are computed separately, joining them loses nothing
+    data = moon.calendar_data(start, end)
+    assert [p["date_time"] for p in data["phases"]] == [
+        moon.utc_iso(jd) for jd, _ in events.phases
+    ]
+    assert len(data["ingresses"]) == len(events.ingresses)
+    assert data["phases"][-1] == {"date_time": "2024-01-11T11:57:25Z", "phase": "New"}
+
+
+def swe_difference(a, b):
+    return (a - b + 180) % 360 - 180
+
+
+def test_aspect_windows_match_daily_charts():
+    start = datetime(2024, 3, 1)
+    start_jd = date.to_jd(start)
+    windows = aspect_events.find_aspects(
+        start_jd, start_jd + 30, planets, forecast_settings
+    )
+
+    for day in range(30):
+        jd = start_jd + day
+        expected = {
+            (a["active"], a["passive"], a["aspect"])
+            for a in day_forecast(start + timedelta(days=day))["aspects"]
+        }
+        found = set()
+        for a, b, aspect, enters, leaves, exact in windows:
+            if (enters is None or enters <= jd) and (leaves is None or jd < leaves):
+                found.add((a, b, aspect))
+        found = {
+            (*sorted([names.PLANETS[a], names.PLANETS[b]]), aspect)
+            for a, b, aspect in found
+        }
+        assert {(*sorted([a, p]), x) for a, p, x in expected} == found
+
+    for a, b, aspect, enters, leaves, exact in windows:
+        for jd in exact:
+            lon_a = ephemeris.get_planet(a, jd)["lon"]
+            lon_b = ephemeris.get_planet(b, jd)["lon"]
+            assert abs(abs(swe_difference(lon_b, lon_a)) - aspect) < 1e-4
+
+
+def test_planet_positions_match_natal_chart():
+    for date_time, lat, lon in (
+        (datetime(1990, 9, 5, 15), 55.3948, 43.8399),
+        (datetime(1985, 1, 2, 6), -33.9, 151.2),
+        (datetime(2001, 7, 19, 22), 64.1, -21.9),
+    ):
+        natal = charts.Natal(charts.Subject(date_time, lat, lon))
+        expected = [
+            {
+                "name": obj.name,
+                "latitude": obj.latitude.formatted,
+                "longitude": obj.longitude.formatted,
+                "sign": obj.sign.name,
+                "sign_longitude": obj.sign_longitude.formatted,
+                "house": obj.house.name,
+                "speed": obj.speed,
+                "distance": obj.distance,
+                "movement": obj.movement.formatted,
+            }
+            for obj in natal.objects.values()
+            if obj.type.index == chart.PLANET
+        ]
+        assert workers.planet_positions(date_time, lat, lon) == expected
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+import workers
+
+
+def test_run_each_bounds_its_share_of_the_queue(monkeypatch):
+    monkeypatch.setattr(workers, "backend", "thread")
+    monkeypatch.setattr(workers, "max_workers", 2)
+    queued = []
+
+    def square(chunk):
+        queued.append(workers._pending)
+        time.sleep(0.01)
+        if chunk == [3]:
+            raise ValueError("three")
+        return chunk[0] ** 2
+
+    async def main():
+        return [
+            result async for result in workers.run_each(square, [[i] for i in range(6)])
+        ]
+
+    results = dict((chunk[0], result) for chunk, result in asyncio.run(main()))
+    assert results.keys() == set(range(6))
+    assert results[5] == 25
+    assert isinstance(results[3], ValueError)
+    assert max(queued) <= 2
+    assert workers._pending == 0
+
+
+def test_timed_out_tasks_hold_their_slot(monkeypatch):
+    monkeypatch.setattr(workers, "backend", "thread")
+    monkeypatch.setattr(workers, "max_queue", 1)
+    monkeypatch.setattr(workers, "task_timeout", 0.05)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await workers.run(time.sleep, 0.5)
+        # Still running, so the queue is full
+        with pytest.raises(workers.Busy):
+            await workers.run(time.sleep, 0)
+        await asyncio.sleep(0.6)
+        await workers.run(time.sleep, 0)
+
+    asyncio.run(main())
+    assert workers._pending == 0
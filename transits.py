@@ -0,0 +1,155 @@
+"""
+Transit and progression charts for clients that poll the same subject all
+day. The natal chart only depends on the subject, so it is built once and
+kept in an LRU. Transits are cast for the current UTC minute: the objects
+whose positions don't depend on the observer (planets, nodes, asteroids...)
+are computed once per minute and shared by every request, and only the
+angles, houses, observer-dependent points and the aspects to the natal
+chart are computed per request.
+
+"""
+
+import os
+from datetime import datetime, timezone
+from immanuel import charts
+from immanuel.const import chart
+from immanuel.setup import settings as default_settings
+from immanuel.tools import ephemeris
+from caching import LRUCache
+
+# Objects computed from the observer's coordinates, everything else only
+# depends on the moment
+observer_types = (chart.ANGLE, chart.HOUSE)
+observer_points = (
+    chart.VERTEX,
+    chart.PART_OF_FORTUNE,
+    chart.PART_OF_SPIRIT,
+    chart.PART_OF_EROS,
+)
+
+natal_charts = LRUCache(maxsize=int(os.getenv("NATAL_CACHE_SIZE", 4096)))
+skies = LRUCache(maxsize=4)
+
+
+def depends_on_observer(index):
+    return isinstance(index, int) and (
+        index in observer_types
+        or round(index, -2) in observer_types
+        or index in observer_points
+    )
+
+
+def current_minute():
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0)
+
+
+def natal_chart(date_time, lat, lon):
+    """Natal chart for a subject, shared between requests. Charts are not
+    modified once built, so callers may use it as aspects_to."""
+    key = (date_time.isoformat(), lat, lon)
+    natal = natal_charts.get(key)
+    if natal is None:
+        natal = charts.Natal(charts.Subject(date_time, lat, lon))
+        natal_charts.set(key, natal)
+    return natal
+
+
+class Sky:
+    """The observer-independent part of a chart for one moment."""
+
+    def __init__(self, jd, settings):
+        self.obliquity = ephemeris.earth_obliquity(jd)
+        self.sun = ephemeris.get_planet(chart.SUN, jd)
+        self.moon = ephemeris.get_planet(chart.MOON, jd)
+        self.objects = ephemeris.get_objects(
+            object_list=[
+                index for index in settings.objects if not depends_on_observer(index)
+            ],
+            jd=jd,
+            # Never used for these objects, but points insist on a latitude
+            lat=0.0,
+            lon=0.0,
+        )
+
+
+def sky_at(jd, settings=default_settings):
+    key = (jd, tuple(settings.objects))
+    sky = skies.get(key)
+    if sky is None:
+        sky = Sky(jd, settings)
+        skies.set(key, sky)
+    return sky
+
+
+class Transits(charts.Transits):
+    """charts.Transits cast for a given moment instead of now, taking the
+    observer-independent objects from the shared sky."""
+
+    def __init__(
+        self,
+        subject,
+        aspects_to=None,
+        settings=default_settings,
+    ):
+        self._native = subject
+        self._houses_for_aspected = False
+        charts.Chart.__init__(self, chart.TRANSITS, aspects_to, settings)
+
+    def generate(self):
+        jd = self._native.julian_date
+        lat, lon = self._native.latitude, self._native.longitude
+        house_system = self._settings.house_system
+        sky = sky_at(jd, self._settings)
+        self._obliquity = sky.obliquity
+        self._triad[chart.SUN] = sky.sun
+        self._triad[chart.MOON] = sky.moon
+        self._triad[chart.ASC] = ephemeris.get_angle(
+            index=chart.ASC, jd=jd, lat=lat, lon=lon, house_system=house_system
+        )
+        self._diurnal = ephemeris.is_daytime_from(sky.sun, self._triad[chart.ASC])
+        self._moon_phase = ephemeris.moon_phase_from(sky.sun, sky.moon)
+        observer_objects = ephemeris.get_objects(
+            object_list=[
+                index for index in self._settings.objects if depends_on_observer(index)
+            ],
+            jd=jd,
+            lat=lat,
+            lon=lon,
+            house_system=house_system,
+            part_formula=self._settings.part_formula,
+        )
+        self._objects = {
+            index: (
+                observer_objects[index]
+                if index in observer_objects
+                else sky.objects[index]
+            )
+            for index in self._settings.objects
+        }
+        self._houses = ephemeris.get_houses(
+            jd=jd, lat=lat, lon=lon, house_system=house_system
+        )
+
+
+def local_subject(moment, subject):
+    """A subject at the same place as subject, for the aware moment."""
+    zone = subject.date_time.tzinfo
+    return charts.Subject(
+        moment.astimezone(zone),
+        subject.latitude,
+        subject.longitude,
+        timezone=getattr(zone, "key", None),
+    )
+
+
+def transits_chart(natal, moment=None):
+    """Transits to natal, at the natal location, for moment (an aware
+    datetime), by default the current minute."""
+    subject = local_subject(moment or current_minute(), natal._native)
+    return Transits(subject, aspects_to=natal)
+
+
+def progressed_chart(natal, moment=None):
+    subject = natal._native
+    moment = (moment or current_minute()).astimezone(subject.date_time.tzinfo)
+    return charts.Progressed(subject, moment.replace(tzinfo=None))
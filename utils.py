@@ -1,8 +1,17 @@
+import math
+import os
 from datetime import datetime, timedelta
 from immanuel import charts
-from immanuel.tools import date, ephemeris
-from immanuel.const import chart, calc
-from immanuel.setup import settings
+import numpy as np
+from immanuel.tools import date
+from immanuel.const import chart, calc, names
+from immanuel.setup import ImmanuelSettings
+import aspect_events
+import ephemeris_index
+from events import find_stations
+from forecast_store import ForecastStore
+from moon import utc_iso
+from positions import PositionTable
 
 planets = [
     chart.MERCURY,
@@ -15,6 +24,8 @@ planets = [
     chart.PLUTO,
 ]
 
+house_names = {n: names.HOUSES[chart.HOUSE + n] for n in range(1, 13)}
+
 planet_names = [
     "Mercury",
     "Venus",
@@ -27,88 +38,83 @@ planet_names = [
 ]
 
 
-def retrograde_periods(n, lat, lon):
-    retro_table = {obj: [] for obj in planets}
+def jd_to_datetime(jd):
+    return date.to_datetime(jd).replace(tzinfo=None)
 
-    coords = [lat, lon]
+
+def retrograde_periods(n, lat, lon, start_date=None):
+    retro_table = {obj: [] for obj in planets}
 
     # Get the current date and time
-    now = datetime.now()
+    now = start_date or datetime.now()
     end_date = now + timedelta(days=n * 30)
 
     start_day = datetime(now.year, now.month, now.day, 0, 0, 0, 0, None)
     end_day = datetime(end_date.year, end_date.month, end_date.day, 0, 0, 0, 0, None)
+    start_jd = date.to_jd(start_day)
+    end_jd = date.to_jd(end_day)
 
-    buffer = {
-        obj: {
-            "start": None,
-            "end": None,
-            "current_direction": calc.DIRECT,
-        }
-        for obj in planets
-    }
+    index = ephemeris_index.current()
+    indexed = index is not None and index.covers(start_jd, end_jd)
+    if not indexed:
+        table = PositionTable([start_jd], planets)
 
-    current_day = start_day
-    while current_day < end_day:
-        day_jd = date.to_jd(current_day)
-        objects = ephemeris.get_objects(
-            tuple(planets),
-            day_jd,
-            *coords,
-            chart.PLACIDUS,
-            calc.DAY_NIGHT_FORMULA,
-        ).values()
-        for obj in list(objects):
-            movement = ephemeris.object_movement(obj)
-            if (
-                movement == calc.RETROGRADE
-                and buffer[obj["index"]]["current_direction"] == calc.DIRECT
-            ):
-                buffer[obj["index"]]["start"] = current_day
-                buffer[obj["index"]]["current_direction"] = calc.RETROGRADE
-            elif (
-                movement == calc.DIRECT
-                and buffer[obj["index"]]["current_direction"] == calc.RETROGRADE
-            ):
-                buffer[obj["index"]]["end"] = current_day
-                buffer[obj["index"]]["current_direction"] = calc.DIRECT
-                retro_table[obj["index"]].append(
-                    (buffer[obj["index"]]["start"], buffer[obj["index"]]["end"])
-                )
-        current_day = current_day + timedelta(minutes=30)
+    for obj in planets:
+        if indexed:
+            movement = index.state_at("movement", obj, start_jd)
+            stations = index.changes("movement", obj, start_jd, end_jd)
+        else:
+            movement = int(table.movement[table.row(obj), 0])
+            stations = find_stations(obj, start_jd, end_jd)
 
-    for obj in buffer:
-        if (
-            buffer[obj]["current_direction"] == calc.RETROGRADE
-            and buffer[obj]["start"] != None
-            and buffer[obj]["end"] == None
-        ):
-            retro_table[obj].append((buffer[obj]["start"], end_day))
+        start = start_day if movement == calc.RETROGRADE else None
+        for jd, movement in stations:
+            if movement == calc.RETROGRADE and start is None:
+                start = jd_to_datetime(jd)
+            elif movement == calc.DIRECT and start is not None:
+                retro_table[obj].append((start, jd_to_datetime(jd)))
+                start = None
+        if start is not None:
+            retro_table[obj].append((start, end_day))
 
     return retro_table
 
 
-def daily_forecast_data(start_date):
-    settings.set({"objects": planets})
-    return day_forecast(start_date)
+def chart_settings(**options):
+    """Returns a private ImmanuelSettings instance with the given options
+    applied. Charts take it as an argument, so per-request options never
+    go through the process-global settings.set()."""
+    settings = ImmanuelSettings()
+    for key, value in options.items():
+        setattr(settings, key, value)
+    return settings
+
+
+# Forecast charts only carry the eight planets. Charts never write to their
+# settings, so this one instance is safely shared between threads.
+forecast_settings = chart_settings(objects=planets)
+
 
+def daily_forecast_data(start_date, settings=forecast_settings):
+    if settings is forecast_settings:
+        return day_store.get(start_date)
+    return day_forecast(start_date, settings)
 
-def weekly_forecast_data(start_date):
-    settings.set({"objects": planets})
 
+def weekly_forecast_data(start_date, settings=forecast_settings):
     # Preparing data for weekly forecast
     weekly_data = {}
 
     for i in range(7):  # for each day of week
         date = start_date + timedelta(days=i)
-        weekly_data[date.strftime("%Y-%m-%d")] = day_forecast(date)
+        weekly_data[date.strftime("%Y-%m-%d")] = daily_forecast_data(date, settings)
 
     return weekly_data
 
 
-def day_forecast(date):
+def day_forecast(date, settings=forecast_settings):
     native = charts.Subject(date_time=date, latitude=0.0, longitude=0.0)
-    natal = charts.Natal(native)
+    natal = charts.Natal(native, settings=settings)
 
     planet_positions = {}
     for object in natal.objects.values():
@@ -141,55 +147,144 @@ def day_forecast(date):
     }
 
 
-def yearly_forecast_data(start_date):
-    settings.set({"objects": planets})
+# Default-settings day forecasts only depend on the date
+day_store = ForecastStore(
+    day_forecast,
+    maxsize=int(os.getenv("FORECAST_CACHE_SIZE", 1024)),
+    path=os.getenv("FORECAST_STORE_PATH"),
+)
 
-    attributes = ["sign", "house", "movement"]
-    cursor = {}
-    planet_positions = {}
-    for object in planet_names:
-        planet_positions[object] = {"sign": [], "house": [], "movement": []}
 
-    for i in range(365):  # for each day of week
-        date = start_date + timedelta(days=i)
+def daily_changes(start_jd, days, events):
+    """Maps exact (jd, value) events onto the 00:00 samples a forecast is
+    reported at, keeping only the value in force at each sample."""
+    changes = {}
+    for jd, value in events:
+        day = math.ceil(jd - start_jd)
+        if 0 < day < days:
+            changes[day] = value
+    return sorted(changes.items())
 
-        native = charts.Subject(date_time=date, latitude=0.0, longitude=0.0)
-        natal = charts.Natal(native)
-
-        for object in natal.objects.values():
-            if cursor.get(object.name) is None:
-                cursor[object.name] = {}
-                for key in attributes:
-                    attr = getattr(object, key)
-                    cursor[object.name][key] = {
-                        "value": attr.formatted if key == "movement" else attr.name,
-                        "start": date,
-                    }
-            else:
-                for key in attributes:
-                    attr = getattr(object, key)
-                    value = attr.formatted if key == "movement" else attr.name
-                    if cursor[object.name][key]["value"] != value:
-                        period = f'{cursor[object.name][key]["start"].strftime("%Y-%m-%d")} - {(date - timedelta(days=1)).strftime("%Y-%m-%d")}'
-                        planet_positions[object.name][key].append(
-                            {
-                                "period": period,
-                                "value": cursor[object.name][key]["value"],
-                            }
-                        )
-                        cursor[object.name][key] = {
-                            "value": value,
-                            "start": date,
-                        }
-
-    for object in planet_names:
-        for key in attributes:
-            period = f'{cursor[object][key]["start"].strftime("%Y-%m-%d")} - {(start_date + timedelta(days=365)).strftime("%Y-%m-%d")}'
-            planet_positions[object][key].append(
-                {
-                    "period": period,
-                    "value": cursor[object][key]["value"],
-                }
+
+def forecast_periods(start_date, days, initial, changes):
+    periods = []
+    value, start = initial, start_date
+    for day, new_value in changes:
+        if new_value == value:
+            continue
+        change_date = start_date + timedelta(days=day)
+        period = f'{start.strftime("%Y-%m-%d")} - {(change_date - timedelta(days=1)).strftime("%Y-%m-%d")}'
+        periods.append({"period": period, "value": value})
+        value, start = new_value, change_date
+    period = f'{start.strftime("%Y-%m-%d")} - {(start_date + timedelta(days=days)).strftime("%Y-%m-%d")}'
+    periods.append({"period": period, "value": value})
+    return periods
+
+
+forecast_labels = {
+    "sign": names.SIGNS,
+    "house": house_names,
+    "movement": names.OBJECT_MOVEMENTS,
+}
+
+
+def indexed_yearly_forecast_data(index, start_date, days=365):
+    start_jd = date.to_jd(start_date)
+    end_jd = start_jd + days - 1
+
+    planet_positions = {}
+    for obj, name in zip(planets, planet_names):
+        planet_positions[name] = {}
+        for kind, labels in forecast_labels.items():
+            changes = daily_changes(
+                start_jd, days, index.changes(kind, obj, start_jd, end_jd)
+            )
+            planet_positions[name][kind] = forecast_periods(
+                start_date,
+                days,
+                labels[index.state_at(kind, obj, start_jd)],
+                [(day, labels[value]) for day, value in changes],
             )
 
     return planet_positions
+
+
+def yearly_forecast_data(start_date, years=1):
+    days = 365 * years
+    start_jd = date.to_jd(start_date)
+    index = ephemeris_index.timeline(start_jd, start_jd + days - 1)
+    return indexed_yearly_forecast_data(index, start_date, days)
+
+
+def aspect_timeline_data(start_date, days=7, settings=forecast_settings):
+    """Exact times of the aspects between the forecast planets over days
+    from start_date, the same aspects day_forecast reports at midnights."""
+    start_jd = date.to_jd(start_date)
+    windows = aspect_events.find_aspects(
+        start_jd, start_jd + days, settings.objects, settings
+    )
+    return [
+        {
+            "active": names.PLANETS[a],
+            "passive": names.PLANETS[b],
+            "aspect": aspect,
+            "type": names.ASPECTS[aspect],
+            "enters": None if enters is None else utc_iso(enters),
+            "leaves": None if leaves is None else utc_iso(leaves),
+            "exact": [utc_iso(jd) for jd in exact],
+        }
+        for a, b, aspect, enters, leaves, exact in windows
+    ]
+
+
+def ephemeris_table_data(start_date, end_date, step=1.0):
+    """Columns of planet positions sampled every step days from start_date
+    through end_date."""
+    offsets = np.arange(0, (end_date - start_date).days + 1e-9, step)
+    table = PositionTable(date.to_jd(start_date) + offsets, planets)
+
+    planet_columns = {}
+    for row, name in enumerate(planet_names):
+        planet_columns[name] = {
+            "longitude": table.longitude[row].tolist(),
+            "latitude": table.latitude[row].tolist(),
+            "speed": table.speed[row].tolist(),
+            "sign": [names.SIGNS[sign] for sign in table.sign[row].tolist()],
+            "movement": [
+                names.OBJECT_MOVEMENTS[movement]
+                for movement in table.movement[row].tolist()
+            ],
+        }
+
+    return {
+        "date": [
+            (start_date + timedelta(days=offset)).isoformat()
+            for offset in offsets.tolist()
+        ],
+        "planets": planet_columns,
+    }
+
+
+def position_rows(start, end, step=1.0, chunk_size=256):
+    """Yields one row per planet per sample from start through end, every
+    step days. Positions are computed chunk_size samples at a time, so
+    memory use doesn't grow with the range."""
+    samples = math.floor((end - start).total_seconds() / 86400 / step + 1e-9) + 1
+    start_jd = date.to_jd(start)
+    for first in range(0, samples, chunk_size):
+        offsets = np.arange(first, min(first + chunk_size, samples)) * step
+        table = PositionTable(start_jd + offsets, planets)
+        for column, offset in enumerate(offsets.tolist()):
+            sample_date = (start + timedelta(days=offset)).isoformat()
+            for row, name in enumerate(planet_names):
+                yield {
+                    "date": sample_date,
+                    "planet": name,
+                    "longitude": float(table.longitude[row, column]),
+                    "latitude": float(table.latitude[row, column]),
+                    "speed": float(table.speed[row, column]),
+                    "sign": names.SIGNS[int(table.sign[row, column])],
+                    "movement": names.OBJECT_MOVEMENTS[
+                        int(table.movement[row, column])
+                    ],
+                }
@@ -0,0 +1,98 @@
+"""
+HTTP caching for GET routes. Their results only depend on the request, the
+library and the ephemeris, so the ETag is computed from those alone, from
+
+- the route, its query parameters and the Accept header,
+- the versions of immanuel and the Swiss Ephemeris and the ephemeris data
+  files in SE_EPHE_PATH,
+- for routes relative to now, the current sky snapshot's moment,
+
+and a request whose If-None-Match matches it is answered with a 304 before
+anything is computed.
+
+Results for given dates never change and are sent with a Cache-Control
+max-age of HTTP_CACHE_MAX_AGE seconds, results relative to now are only
+cached until the sky snapshot is next refreshed.
+
+"""
+
+import hashlib
+import json
+import os
+from importlib.metadata import version
+import swisseph as swe
+import sky
+
+max_age = int(os.getenv("HTTP_CACHE_MAX_AGE", 30 * 24 * 3600))
+
+# Routes whose results are fixed by their parameters
+pinned = {
+    "/natal.json",
+    "/natal.txt",
+    "/planetary_positions",
+    "/planetary_positions/range",
+    "/get_daily_forecast_data",
+    "/get_weekly_forecast_data",
+    "/get_yearly_forecast_data",
+    "/moon_calendar",
+    "/aspect_timeline",
+    "/ephemeris_table",
+}
+
+# Routes whose results depend on the current moment
+relative = {"/retrograde_calendar"}
+
+# Query parameters that don't change the result
+ignored = {"profile"}
+
+
+def ephemeris_files(path=None):
+    """(name, size) of each ephemeris data file."""
+    path = path or os.getenv("SE_EPHE_PATH", "")
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return []
+    return [
+        (name, os.path.getsize(os.path.join(path, name)))
+        for name in names
+        if name.endswith(".se1")
+    ]
+
+
+versions = json.dumps(
+    [f"immanuel={version('immanuel')}", f"swisseph={swe.version}", ephemeris_files()]
+)
+
+
+def cacheable(path):
+    return path in pinned or path in relative
+
+
+def etag(path, params, accept=None):
+    """Strong ETag of the response to a GET of path with the query params,
+    a list of (name, value) pairs."""
+    parts = [versions, path, sorted(p for p in params if p[0] not in ignored)]
+    parts.append(accept or "")
+    if path in relative:
+        parts.append(sky.current().moment.isoformat())
+    digest = hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def cache_control(path):
+    if path in relative:
+        return f"public, max-age={sky.refresh_interval}"
+    return f"public, max-age={max_age}"
+
+
+def matches(if_none_match, tag):
+    """Whether an If-None-Match header names tag. Weak tags compare equal to
+    strong ones, as RFC 9110 asks for If-None-Match."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == tag:
+            return True
+    return False
@@ -0,0 +1,308 @@
+"""
+Process pool for CPU-bound chart work. Swiss Ephemeris calls hold the GIL,
+so threads don't add throughput; worker processes do. Everything submitted
+here must be a picklable top-level function that returns bytes or other
+plain data.
+
+Route handlers go through run(), which bounds the number of queued tasks
+and how long a request waits for its result. EXECUTION_BACKEND=thread runs
+the same calls in a thread pool instead, with the same limits.
+
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from immanuel import charts
+from immanuel.const import chart, names
+from immanuel.tools import convert
+import ephemeris_index
+import profiling
+import returns
+from positions import (
+    PositionTable,
+    cusp_table,
+    house_numbers,
+    swe_bodies,
+    timezone_at,
+)
+import serializer
+
+backend = os.getenv("EXECUTION_BACKEND", "process")
+max_workers = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1))
+max_queue = int(os.getenv("WORKER_QUEUE_DEPTH", max_workers * 8))
+task_timeout = float(os.getenv("WORKER_TASK_TIMEOUT", 30))
+
+_pool = None
+_threads = None
+_pending = 0
+_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """Raised by run() when max_queue tasks are already waiting."""
+
+
+def warm_up():
+    """Pool initializer: loads the ephemeris index and casts one chart, so
+    ephemeris files and lookup tables are open before the first request."""
+    ephemeris_index.current()
+    charts.Natal(charts.Subject(datetime(2000, 1, 1), 0.0, 0.0))
+
+
+def ping():
+    return os.getpid()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked, the server process runs threads
+        _pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up,
+        )
+    return _pool
+
+
+def get_executor():
+    global _threads
+    if backend == "process":
+        return get_pool()
+    if _threads is None:
+        _threads = ThreadPoolExecutor(max_workers=max_workers)
+    return _threads
+
+
+def start():
+    """Starts every worker process up front instead of on first use."""
+    if backend == "process":
+        pool = get_pool()
+        for _ in range(max_workers):
+            pool.submit(ping)
+
+
+def check():
+    """Raises Busy if the queue is full."""
+    if _pending >= max_queue:
+        raise Busy()
+
+
+async def run(fn, *args):
+    """Runs fn(*args) on the configured backend. Raises Busy when the
+    queue is full and asyncio.TimeoutError if the result takes longer than
+    task_timeout. A timed out call is cancelled if it hasn't started, and
+    otherwise keeps its place in the queue until it finishes."""
+    global _pending
+    with _lock:
+        check()
+        _pending += 1
+    current = profiling.current()
+    profile = current is not None and current.profile
+    try:
+        future = get_executor().submit(
+            profiling.collect, fn, args, profile, profiling.enabled
+        )
+    except BaseException:
+        release()
+        raise
+    future.add_done_callback(release)
+    try:
+        result, measured = await asyncio.wait_for(
+            asyncio.wrap_future(future), task_timeout
+        )
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise
+    if current is not None:
+        current.merge(measured)
+    return result
+
+
+async def run_each(fn, chunks, *args):
+    """Yields (chunk, result) for fn(chunk, *args) on each of chunks, in
+    the order they finish, with result the exception if the call failed.
+    Each call goes through run(), and at most max_workers of them are
+    queued at a time, so a big batch doesn't crowd out other requests."""
+    chunks = iter(chunks)
+    running = set()
+
+    async def call(chunk):
+        try:
+            return chunk, await run(fn, chunk, *args)
+        except Exception as e:
+            return chunk, e
+
+    try:
+        while True:
+            while len(running) < max_workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                running.add(asyncio.ensure_future(call(chunk)))
+            if not running:
+                return
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in running:
+            task.cancel()
+
+
+def release(future=None):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def shutdown():
+    global _pool, _threads
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+    if _threads is not None:
+        _threads.shutdown(cancel_futures=True)
+        _threads = None
+
+
+def natal_json(date_time, lat, lon, fields=None, media_type="application/json"):
+    native = charts.Subject(date_time, lat, lon)
+    return serializer.encode(charts.Natal(native), fields, media_type)
+
+
+def solar_return_json(
+    date_time, lat, lon, year, fields=None, media_type="application/json"
+):
+    native = charts.Subject(date_time, lat, lon)
+    return serializer.encode(charts.SolarReturn(native, year), fields, media_type)
+
+
+def solar_returns_json(
+    date_time,
+    lat,
+    lon,
+    first_year,
+    last_year,
+    fields,
+    light,
+    media_type="application/json",
+):
+    """A JSON (or MessagePack) array with each year's solar return chart, or
+    with only its moment and angles if light."""
+    native = charts.Subject(date_time, lat, lon)
+    years = list(range(first_year, last_year + 1))
+    if light:
+        return serializer.encode(
+            returns.return_moments(native, years), media_type=media_type
+        )
+    if media_type != "application/json":
+        return serializer.encode(
+            [
+                serializer.select(chart, fields)
+                for chart in returns.solar_returns(native, years)
+            ],
+            media_type=media_type,
+        )
+    return (
+        b"["
+        + b",".join(
+            serializer.dumps(chart, fields)
+            for chart in returns.solar_returns(native, years)
+        )
+        + b"]"
+    )
+
+
+def natal_text(date_time, lat, lon):
+    natal = charts.Natal(charts.Subject(date_time, lat, lon))
+    objects = ""
+    for object in natal.objects.values():
+        objects += f"{object}\n"
+    return f"""
+Daytime: {natal.diurnal}
+Moon Phase: {natal.moon_phase}
+{objects}
+"""
+
+
+def planet_positions(date_time, lat, lon, objects=None, houses=True):
+    """Positions of the given planets (by default the Sun to Pluto) read
+    straight from the ephemeris instead of casting a whole chart. Houses
+    are only placed if houses is true, otherwise "house" is left empty."""
+    objects = objects or list(swe_bodies)
+    native = charts.Subject(date_time, lat, lon, timezone=timezone_at(lat, lon))
+    table = PositionTable([native.julian_date], objects)
+    longitudes = table.longitude[:, 0]
+    if houses:
+        cusps = cusp_table([native.julian_date], lat, lon)
+        numbers = house_numbers(longitudes, cusps.repeat(len(objects), axis=0))
+
+    positions = []
+    for row, obj in enumerate(objects):
+        lon = float(longitudes[row])
+        positions.append(
+            {
+                "name": names.PLANETS[obj],
+                "latitude": dms(float(table.latitude[row, 0])),
+                "longitude": dms(lon),
+                "sign": names.SIGNS[int(table.sign[row, 0])],
+                "sign_longitude": dms(lon % 30),
+                "house": (
+                    names.HOUSES[chart.HOUSE + int(numbers[row])] if houses else ""
+                ),
+                "speed": float(table.speed[row, 0]),
+                "distance": float(table.distance[row, 0]),
+                "movement": names.OBJECT_MOVEMENTS[int(table.movement[row, 0])],
+            }
+        )
+    return positions
+
+
+def dms(angle):
+    """Same formatting as the chart's wrapped angles."""
+    return convert.dec_to_string(
+        angle, format=convert.FORMAT_DMS, round_to=convert.ROUND_SECOND
+    )
+
+
+def natal_lines(subjects, fields=None):
+    """NDJSON lines for a chunk of batch subjects, one natal chart or error
+    per subject, tagged with the client's id."""
+    lines = []
+    for subject in subjects:
+        try:
+            native = charts.Subject(
+                datetime(
+                    subject["year"], subject["month"], subject["day"], subject["hour"]
+                ),
+                subject["lat"],
+                subject["lon"],
+            )
+            data = serializer.dumps(charts.Natal(native), fields)
+            lines.append(result_line(subject["id"], data))
+        except Exception as e:
+            lines.append(error_line(subject["id"], e))
+    return b"".join(lines)
+
+
+def result_line(id, data):
+    return b'{"id":' + json.dumps(id).encode() + b',"success":1,"data":' + data + b"}\n"
+
+
+def error_line(id, error):
+    message = json.dumps(f"{type(error).__name__}: {error}").encode()
+    return (
+        b'{"id":'
+        + json.dumps(id).encode()
+        + b',"success":0,"error":'
+        + message
+        + b"}\n"
+    )